@@ -53,6 +53,76 @@ class Config:
         if not cls._config:
             cls._load_config()
         return cls._config.get('logging', {})
+    
+    @classmethod
+    def get_job_queue_config(cls):
+        """获取分布式任务队列配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('job_queue', {})
+    
+    @classmethod
+    def get_intraday_config(cls):
+        """获取盘中轮询配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('intraday', {})
+    
+    @classmethod
+    def get_backfill_config(cls):
+        """获取历史回补配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('backfill', {})
+    
+    @classmethod
+    def get_validation_config(cls):
+        """获取数据校验配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('validation', {})
+    
+    @classmethod
+    def get_profiling_config(cls):
+        """获取性能分析配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('profiling', {})
+    
+    @classmethod
+    def get_change_feed_config(cls):
+        """获取K线变更推送配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('change_feed', {})
+    
+    @classmethod
+    def get_snapshot_config(cls):
+        """获取截面快照配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('snapshot', {})
+    
+    @classmethod
+    def get_matrix_config(cls):
+        """获取全市场矩阵配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('matrix', {})
+    
+    @classmethod
+    def get_update_config(cls):
+        """获取多频率更新配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('update', {})
+    
+    @classmethod
+    def get_ingestion_config(cls):
+        """获取分块写入配置"""
+        if not cls._config:
+            cls._load_config()
+        return cls._config.get('ingestion', {})
 
 # 导出配置实例
 config = Config()
\ No newline at end of file
@@ -2,9 +2,10 @@
 BaoStock API客户端模块，提供股票数据获取功能
 """
 import baostock as bs
+import numpy as np
 from datetime import datetime, timedelta
 
-from utils.logger import logger
+from utils.logger import logger, EventSampler
 from config import config
 
 class BaostockClient:
@@ -13,6 +14,21 @@ class BaostockClient:
     _instance = None
     _is_logged_in = False
     
+    # 支持的K线频率及名称
+    FREQUENCY_NAMES = {
+        'd': '日',
+        'w': '周',
+        'm': '月',
+        '5': '5分钟',
+        '15': '15分钟',
+        '30': '30分钟',
+        '60': '小时'
+    }
+    MINUTE_FREQUENCIES = ('5', '15', '30', '60')
+    
+    # 列式分块中价格和成交量的列
+    BAR_COLUMNS = ('open', 'high', 'low', 'close', 'volume', 'amount')
+    
     def __new__(cls):
         if cls._instance is None:
             cls._instance = super(BaostockClient, cls).__new__(cls)
@@ -63,12 +79,13 @@ class BaostockClient:
         while (rs.next()):
             data = rs.get_row_data()
             # 只获取股票，不包含指数、基金等
-            # data[0]是股票代码，data[4]是市场类型，data[5]是证券类型
+            # data[0]是股票代码，data[2]是上市日期，data[4]是市场类型，data[5]是证券类型
             if len(data) > 5 and data[5] == '1':  # 1表示股票
                 stock = {
                     'code': data[0],
                     'name': data[1],
                     'market': data[4],
+                    'ipoDate': data[2],
                     'isFocused': False,
                     'isHourFocused': False,
                     'focusedDays': 0,
@@ -81,92 +98,139 @@ class BaostockClient:
         return stock_list
     
     @classmethod
-    def get_daily_k_data(cls, code, start_date=None, end_date=None):
-        """获取股票日K线数据"""
+    def _build_chunk(cls, frequency, rows):
+        """将一批原始行转换为列式分块：时间为datetime64数组，价格和成交量为float64数组"""
+        columns = np.array(rows, dtype=str)
+        if frequency in cls.MINUTE_FREQUENCIES:
+            # 分钟线时间格式为 YYYYMMDDHHMMSSsss
+            times = np.array(
+                [f"{t[:4]}-{t[4:6]}-{t[6:8]}T{t[8:10]}:{t[10:12]}:{t[12:14]}" for t in columns[:, 1]],
+                dtype='datetime64[s]'
+            )
+            offset = 2
+        else:
+            times = columns[:, 0].astype('datetime64[D]')
+            offset = 1
+        if np.isnat(times).any():
+            raise ValueError("时间字段为空")
+        values = columns[:, offset:offset + len(cls.BAR_COLUMNS)]
+        values = np.where(values == '', '0', values).astype(np.float64)
+
+        chunk = {'time': times.astype('datetime64[us]')}
+        for index, column in enumerate(cls.BAR_COLUMNS):
+            chunk[column] = np.ascontiguousarray(values[:, index])
+        if frequency == 'd':
+            # 交易状态，0表示停牌，由校验环节使用后移除
+            chunk['tradeStatus'] = columns[:, offset + len(cls.BAR_COLUMNS)].copy()
+        return chunk
+    
+    @classmethod
+    def _parse_rows(cls, code, frequency, rows):
+        """转换一批原始行，整批转换失败时逐行剔除无法解析的数据"""
+        try:
+            return cls._build_chunk(frequency, rows)
+        except (ValueError, IndexError):
+            valid_rows = []
+            for row in rows:
+                try:
+                    cls._build_chunk(frequency, [row])
+                    valid_rows.append(row)
+                except (ValueError, IndexError) as e:
+                    logger.error(f"处理股票 {code} {cls.FREQUENCY_NAMES[frequency]}线数据时出错: {e}, 数据: {row}")
+            return cls._build_chunk(frequency, valid_rows) if valid_rows else None
+    
+    @classmethod
+    def iter_k_data_chunks(cls, code, frequency='d', start_date=None, end_date=None, adjustflag='3', guard=None):
+        """流式获取股票指定频率的K线数据，每次返回一个列式分块
+        
+        frequency 支持 d/w/m（日、周、月）和 5/15/30/60（分钟），
+        adjustflag 为 3 不复权、2 前复权、1 后复权。
+        分块大小取自 guard（MemoryGuard），每个分块处理完后按当前内存调整下一块的大小
+        """
         cls._login()
         
+        if frequency not in cls.FREQUENCY_NAMES:
+            raise ValueError(f"不支持的K线频率: {frequency}")
         if not start_date:
-            start_date = "1990-01-01"
+            start_date = '1990-01-01'
+        
+        name = cls.FREQUENCY_NAMES[frequency]
+        logger.info(f"正在获取股票 {code} 的{name}K线数据 ({start_date} 至 {end_date})...")
         
-        logger.info(f"正在获取股票 {code} 的日K线数据 ({start_date} 至 {end_date})...")
+        # 分钟线多一个时间字段，日线多一个交易状态字段
+        minute = frequency in cls.MINUTE_FREQUENCIES
+        fields = "date,time,open,high,low,close,volume,amount" if minute else "date,open,high,low,close,volume,amount"
+        if frequency == 'd':
+            fields += ",tradestatus"
         
-        # 查询日K线数据
         rs = bs.query_history_k_data_plus(
             code,
-            "date,open,high,low,close,volume,amount",
+            fields,
             start_date=start_date,
             end_date=end_date,
-            frequency="d",
-            adjustflag="3"  # 不复权
+            frequency=frequency,
+            adjustflag=adjustflag
         )
         
         if rs.error_code != '0':
-            logger.error(f"获取股票 {code} 日K线数据失败: {rs.error_msg}")
-            raise Exception(f"获取股票 {code} 日K线数据失败: {rs.error_msg}")
+            logger.error(f"获取股票 {code} {name}K线数据失败: {rs.error_msg}")
+            raise Exception(f"获取股票 {code} {name}K线数据失败: {rs.error_msg}")
         
-        daily_data = []
+        chunk_size = guard.chunk_size if guard else config.get_ingestion_config().get('chunk_size', 5000)
+        total = 0
+        rows = []
+        sampler = EventSampler()
         while (rs.next()):
             data = rs.get_row_data()
-            k_data = {
-                'time': datetime.strptime(data[0], '%Y-%m-%d'),
-                'open': float(data[1]) if data[1] else 0,
-                'high': float(data[2]) if data[2] else 0,
-                'low': float(data[3]) if data[3] else 0,
-                'close': float(data[4]) if data[4] else 0,
-                'volume': float(data[5]) if data[5] else 0,
-                'amount': float(data[6]) if data[6] else 0
-            }
-            daily_data.append(k_data)
+            # 抽样打印原始数据，查看格式；DEBUG关闭时不做任何格式化
+            if minute and sampler.should_log(code):
+                logger.debug("{}线原始数据: {}", name, data)
+            rows.append(data)
+            if len(rows) >= chunk_size:
+                chunk = cls._parse_rows(code, frequency, rows)
+                rows = []
+                if chunk is not None:
+                    total += len(chunk['time'])
+                    yield chunk
+                if guard:
+                    guard.check()
+                    chunk_size = guard.chunk_size
+        if rows:
+            chunk = cls._parse_rows(code, frequency, rows)
+            if chunk is not None:
+                total += len(chunk['time'])
+                yield chunk
         
-        logger.info(f"成功获取股票 {code} 的 {len(daily_data)} 条日K线数据")
-        return daily_data
+        logger.info(f"成功获取股票 {code} 的 {total} 条{name}K线数据")
+    
+    @classmethod
+    def chunk_to_bars(cls, chunk):
+        """将列式分块转换为写入数据库的K线字典列表"""
+        keys = ('time',) + cls.BAR_COLUMNS
+        columns = [chunk[key].tolist() for key in keys]
+        bars = [dict(zip(keys, values)) for values in zip(*columns)]
+        if 'tradeStatus' in chunk:
+            for bar, status in zip(bars, chunk['tradeStatus'].tolist()):
+                bar['tradeStatus'] = status
+        return bars
+    
+    @classmethod
+    def get_k_data(cls, code, frequency='d', start_date=None, end_date=None, adjustflag='3'):
+        """获取股票指定频率的全部K线数据，返回K线字典列表"""
+        k_data_list = []
+        for chunk in cls.iter_k_data_chunks(code, frequency, start_date, end_date, adjustflag):
+            k_data_list.extend(cls.chunk_to_bars(chunk))
+        return k_data_list
+    
+    @classmethod
+    def get_daily_k_data(cls, code, start_date=None, end_date=None):
+        """获取股票日K线数据"""
+        return cls.get_k_data(code, 'd', start_date, end_date)
     
     @classmethod
     def get_hourly_k_data(cls, code, start_date=None, end_date=None):
         """获取股票小时K线数据"""
-        cls._login()
-        
-        if not start_date:
-            start_date = '1990-01-01'
-        
-        logger.info(f"正在获取股票 {code} 的小时K线数据 ({start_date} 至 {end_date})...")
-        
-        # 查询小时K线数据
-        rs = bs.query_history_k_data_plus(
-            code,
-            "date,time,open,high,low,close,volume,amount",
-            start_date=start_date,
-            end_date=end_date,
-            frequency="60",
-            adjustflag="3"  # 不复权
-        )
-        
-        if rs.error_code != '0':
-            logger.error(f"获取股票 {code} 小时K线数据失败: {rs.error_msg}")
-            raise Exception(f"获取股票 {code} 小时K线数据失败: {rs.error_msg}")
-        
-        hourly_data = []
-        while (rs.next()):
-            data = rs.get_row_data()
-            # 打印原始数据，查看格式
-            logger.debug(f"小时线原始数据: {data}")
-            try:
-                time_obj = datetime.strptime(data[1], '%Y%m%d%H%M%S000')
-                k_data = {
-                    'time': time_obj,
-                    'open': float(data[2]) if data[2] else 0,
-                    'high': float(data[3]) if data[3] else 0,
-                    'low': float(data[4]) if data[4] else 0,
-                    'close': float(data[5]) if data[5] else 0,
-                    'volume': float(data[6]) if data[6] else 0,
-                    'amount': float(data[7]) if data[7] else 0
-                }
-                hourly_data.append(k_data)
-            except Exception as e:
-                logger.error(f"处理小时线数据时出错: {e}, 数据: {data}")
-        
-        logger.info(f"成功获取股票 {code} 的 {len(hourly_data)} 条小时K线数据")
-        return hourly_data
+        return cls.get_k_data(code, '60', start_date, end_date)
     
     @classmethod
     def get_adjust_factor(cls, code, start_date=None, end_date=None):
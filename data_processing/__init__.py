@@ -2,6 +2,11 @@
 数据处理模块，负责处理原始数据并转换为标准格式
 """
 from .stock_processor import StockProcessor
+from .job_worker import JobWorker
+from .intraday_poller import IntradayPoller
+from .backfill_planner import BackfillPlanner
+from .change_feed import ChangeFeed
+from .market_matrix import MarketMatrix
 
-# 导出StockProcessor类
-__all__ = ['StockProcessor']
\ No newline at end of file
+# 导出数据处理类
+__all__ = ['StockProcessor', 'JobWorker', 'IntradayPoller', 'BackfillPlanner', 'ChangeFeed', 'MarketMatrix']
\ No newline at end of file
@@ -0,0 +1,162 @@
+"""
+历史回补规划模块，将缺失的历史数据拆分为分片并行获取
+"""
+import multiprocessing
+from datetime import datetime, timedelta
+
+from utils.logger import logger
+from utils.memory import MemoryGuard
+from config import config
+from data_fetch import BaostockClient
+from db_operations.stock_model import StockModel
+from db_operations.backfill_chunk_model import BackfillChunkModel
+from .bar_validator import BarValidator
+from .stock_processor import StockProcessor
+
+class BackfillPlanner:
+    """历史回补规划类，按上市日期和频率拆分分片，多进程并行获取并逐片提交"""
+
+    # 频率对应的K线数组字段和获取方法名
+    FREQUENCIES = {
+        'd': ('dayLine', 'get_daily_k_data'),
+        '60': ('hourLine', 'get_hourly_k_data')
+    }
+
+    DEFAULT_CHUNK_DAYS = {'d': 1825, '60': 365}
+
+    @classmethod
+    def get_chunk_days(cls, frequency):
+        """获取指定频率每个分片覆盖的天数"""
+        chunk_days = config.get_backfill_config().get('chunk_days', {})
+        return chunk_days.get(frequency, cls.DEFAULT_CHUNK_DAYS[frequency])
+
+    @classmethod
+    def split_range(cls, start_date, end_date, chunk_days):
+        """将日期区间拆分为若干个首尾相接的子区间"""
+        start = datetime.strptime(start_date, '%Y-%m-%d')
+        end = datetime.strptime(end_date, '%Y-%m-%d')
+        ranges = []
+        while start <= end:
+            chunk_end = min(start + timedelta(days=chunk_days - 1), end)
+            ranges.append((start.strftime('%Y-%m-%d'), chunk_end.strftime('%Y-%m-%d')))
+            start = chunk_end + timedelta(days=1)
+        return ranges
+
+    @classmethod
+    def plan_stock(cls, stock, frequency, end_date):
+        """为单只股票登记缺失历史的分片，返回新登记的分片数量
+
+        缺失部分包括上市日期到已有第一条K线之前的历史（由盘中轮询或指定日期更新开始的数组），
+        以及最后一条K线之后的数据
+        """
+        code = stock['code']
+        field, _ = cls.FREQUENCIES[frequency]
+
+        # 仍有未完成分片时沿用原计划，避免与已提交的乱序分片产生缺口
+        if BackfillChunkModel.has_open_chunks(code, frequency):
+            return 0
+        # 已完成的分片数据已在K线数组中，删除后重新规划的相同区间（如当天K线发布前获取过的区间）不会被当作已完成
+        BackfillChunkModel.remove_done(code, frequency)
+
+        ipo_date = stock.get('ipoDate') or '1990-01-01'
+        chunk_days = cls.get_chunk_days(frequency)
+        chunk_count = 0
+
+        first_time = StockModel.get_first_bar_time(code, field)
+        if first_time and first_time.strftime('%Y-%m-%d') > ipo_date:
+            # 到第一条K线所在日期为止，提交时只保留之前的K线
+            head_end = min(first_time.strftime('%Y-%m-%d'), end_date)
+            for start, end in cls.split_range(ipo_date, head_end, chunk_days):
+                BackfillChunkModel.add_chunk(code, frequency, start, end, before=first_time)
+                chunk_count += 1
+
+        last_time = StockModel.get_last_bar_time(code, field)
+        # 从最后一条K线所在日期开始，提交时只保留之后的K线
+        start_date = last_time.strftime('%Y-%m-%d') if last_time else ipo_date
+        if start_date <= end_date:
+            for start, end in cls.split_range(start_date, end_date, chunk_days):
+                BackfillChunkModel.add_chunk(code, frequency, start, end, after=last_time)
+                chunk_count += 1
+        return chunk_count
+
+    @classmethod
+    def plan(cls, frequency, code=None, end_date=None):
+        """为指定股票或全部股票登记回补分片，返回新登记的分片数量"""
+        end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+        query = {'code': code} if code else None
+
+        BackfillChunkModel.reset_unfinished(frequency, code)
+        chunk_count = 0
+        for stock in StockModel.iter_stocks(query, projection={'code': 1, 'ipoDate': 1}):
+            chunk_count += cls.plan_stock(stock, frequency, end_date)
+
+        logger.info(f"回补规划完成: 频率 {frequency}，新登记 {chunk_count} 个分片")
+        return chunk_count
+
+    @classmethod
+    def run_chunk(cls, chunk):
+        """获取并提交单个分片，返回写入的K线数量"""
+        field, fetch_method = cls.FREQUENCIES[chunk['frequency']]
+        bars = getattr(BaostockClient(), fetch_method)(chunk['code'], chunk['start'], chunk['end'])
+        bars, _ = BarValidator.validate(chunk['code'], bars, chunk['frequency'])
+        if chunk.get('after'):
+            bars = [bar for bar in bars if bar['time'] > chunk['after']]
+        if chunk.get('before'):
+            bars = [bar for bar in bars if bar['time'] < chunk['before']]
+        count = StockModel.commit_chunk(chunk['code'], field, bars)
+        if count:
+            StockProcessor.after_commit(chunk['code'], chunk['frequency'], bars)
+        BackfillChunkModel.mark_done(chunk['_id'], count)
+        return count
+
+    @classmethod
+    def run_worker(cls, frequency, code=None):
+        """循环领取并处理分片，失败的分片单独重试，返回写入的K线总数"""
+        total_count = 0
+        try:
+            while True:
+                chunk = BackfillChunkModel.claim_chunk(frequency, code)
+                if not chunk:
+                    break
+                try:
+                    total_count += cls.run_chunk(chunk)
+                except Exception as e:
+                    status = BackfillChunkModel.mark_failed(chunk, e)
+                    logger.error(
+                        f"回补分片失败 {chunk['code']} {chunk['start']}~{chunk['end']} "
+                        f"(第 {chunk['attempts']} 次尝试，状态 {status}): {e}"
+                    )
+        finally:
+            BaostockClient.logout()
+        return total_count
+
+    @classmethod
+    def run(cls, frequency, code=None, workers=None):
+        """启动多个进程并行处理已登记的分片，返回各状态的分片数量"""
+        workers = workers or config.get_backfill_config().get('workers', 4)
+
+        if workers <= 1:
+            cls.run_worker(frequency, code)
+        else:
+            # 每个进程独立登录BaoStock并连接数据库
+            context = multiprocessing.get_context('spawn')
+            processes = [
+                context.Process(target=cls.run_worker, args=(frequency, code))
+                for _ in range(workers)
+            ]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                if process.exitcode != 0:
+                    # 异常退出的进程手上的分片保持运行中状态，超过 running_timeout_seconds 后才会被重新领取
+                    logger.error(f"回补工作进程 {process.pid} 异常退出，退出码 {process.exitcode}")
+
+        status = BackfillChunkModel.count_by_status(frequency, code)
+        logger.info(
+            f"回补完成: 频率 {frequency}，已完成 {status['done']} 个分片，"
+            f"失败 {status['failed']} 个，待处理 {status['pending']} 个，运行中 {status['running']} 个，"
+            f"峰值内存 主进程 {MemoryGuard.peak_rss_mb():.0f} MB，"
+            f"工作进程 {MemoryGuard.peak_rss_mb(children=True):.0f} MB"
+        )
+        return status
@@ -0,0 +1,130 @@
+"""
+K线数据校验模块，在写入数据库前批量检查并剔除异常数据
+"""
+import numpy as np
+
+from utils.logger import logger
+from config import config
+from db_operations.data_quality_model import DataQualityModel
+
+class BarValidator:
+    """K线数据校验类，对一批K线做向量化检查，标记停牌并剔除异常行"""
+
+    # 校验项，依次为停牌、非正价格、高低价及开收盘价不一致、成交量/额为负、时间重复
+    CHECKS = ('suspended', 'nonPositivePrice', 'ohlcInvalid', 'badVolume', 'duplicate')
+
+    @classmethod
+    def inspect(cls, bars, adjusted=False, baseline_volume=None):
+        """对一批K线执行向量化检查，返回各校验项的布尔掩码和成交量异常放大掩码"""
+        times = np.array([bar['time'] for bar in bars], dtype='datetime64[us]')
+        prices = np.array([[bar['open'], bar['high'], bar['low'], bar['close']] for bar in bars], dtype=float)
+        volume = np.array([bar['volume'] for bar in bars], dtype=float)
+        amount = np.array([bar['amount'] for bar in bars], dtype=float)
+        trade_status = np.array([bar.get('tradeStatus', '1') for bar in bars])
+        return cls.inspect_columns(times, prices, volume, amount, trade_status, adjusted, baseline_volume)
+
+    @classmethod
+    def inspect_columns(cls, times, prices, volume, amount, trade_status=None, adjusted=False, baseline_volume=None):
+        """对列式K线执行向量化检查，prices为开高低收四列
+
+        复权数据（adjusted）的早期价格经前复权后可能为0或负数，不做非正价格检查；
+        baseline_volume 为已保存K线的平均成交量，本批K线太少时作为成交量异常放大的基准
+        """
+        count = len(times)
+        open_, high, low, close = prices.T
+        if trade_status is None:
+            trade_status = np.full(count, '1')
+
+        # 日线带交易状态；无交易状态时，价格和成交量全为0的行视为停牌
+        suspended = (trade_status == '0') | ((volume == 0) & (prices <= 0).all(axis=1))
+        non_positive = (prices <= 0).any(axis=1) & ~suspended
+        masks = {
+            'suspended': suspended,
+            'nonPositivePrice': np.zeros(count, dtype=bool) if adjusted else non_positive,
+            'ohlcInvalid': (high < low) | (open_ > high) | (open_ < low) | (close > high) | (close < low),
+            'badVolume': (volume < 0) | (amount < 0),
+        }
+
+        # 同一时间出现多次时保留最后一条
+        _, last_index = np.unique(times[::-1], return_index=True)
+        duplicate = np.ones(count, dtype=bool)
+        duplicate[count - 1 - last_index] = False
+        masks['duplicate'] = duplicate
+
+        # 成交量相对基准异常放大的只标记不剔除；本批K线足够多时以本批中位数为基准，
+        # 增量更新每批只有一两条K线，以已保存K线的平均成交量为基准，两者都没有时不检查
+        validation_config = config.get_validation_config()
+        spike_ratio = validation_config.get('volume_spike_ratio', 50)
+        traded = volume[volume > 0]
+        if len(traded) >= validation_config.get('volume_spike_min_bars', 20):
+            baseline_volume = np.median(traded)
+        volume_spike = (
+            volume > baseline_volume * spike_ratio if baseline_volume and baseline_volume > 0
+            else np.zeros(count, dtype=bool)
+        )
+
+        return times, masks, volume_spike
+
+    @classmethod
+    def _select(cls, times, masks):
+        """返回通过全部校验的行号，按时间排序"""
+        rejected = np.zeros(len(times), dtype=bool)
+        for check in cls.CHECKS:
+            rejected |= masks[check]
+        kept = np.flatnonzero(~rejected)
+        return kept[np.argsort(times[kept], kind='stable')]
+
+    @classmethod
+    def _report(cls, code, frequency, times, kept_count, masks, volume_spike):
+        """统计本批各校验项的数量，有问题时按K线时间记录数据质量"""
+        masks = {**masks, 'volumeSpike': volume_spike}
+        counts = {check: int(mask.sum()) for check, mask in masks.items()}
+        if any(counts.values()):
+            DataQualityModel.record(
+                code, frequency, {check: times[mask].tolist() for check, mask in masks.items() if counts[check]}
+            )
+            logger.info(
+                f"股票 {code} 频率 {frequency} 数据校验: 共 {len(times)} 条，保留 {kept_count} 条，"
+                f"问题统计 {counts}"
+            )
+        return counts
+
+    @classmethod
+    def validate(cls, code, bars, frequency, adjusted=False, baseline_volume=None):
+        """校验一批K线，返回按时间排序的有效K线和各校验项的数量"""
+        if not bars:
+            return [], {}
+
+        times, masks, volume_spike = cls.inspect(bars, adjusted, baseline_volume)
+        clean_bars = []
+        for index in cls._select(times, masks):
+            bar = bars[index]
+            bar.pop('tradeStatus', None)
+            clean_bars.append(bar)
+
+        counts = cls._report(code, frequency, times, len(clean_bars), masks, volume_spike)
+        return clean_bars, counts
+
+    @classmethod
+    def validate_chunk(cls, code, chunk, frequency, adjusted=False, after=None, baseline_volume=None):
+        """校验一个列式K线分块，返回按时间排序的有效分块（不含交易状态列）和各校验项的数量
+
+        after 为上一个分块的最后时间，不晚于它的行按重复处理，跨分块边界的重复时间保留先出现的一条；
+        成交量异常放大以本分块的成交量中位数为基准，分块太小时以 baseline_volume 为基准
+        """
+        total = len(chunk['time'])
+        if not total:
+            return chunk, {}
+
+        prices = np.column_stack([chunk['open'], chunk['high'], chunk['low'], chunk['close']])
+        times, masks, volume_spike = cls.inspect_columns(
+            chunk['time'], prices, chunk['volume'], chunk['amount'], chunk.get('tradeStatus'),
+            adjusted, baseline_volume
+        )
+        if after is not None:
+            masks['duplicate'] |= times <= np.datetime64(after, 'us')
+        kept = cls._select(times, masks)
+        clean_chunk = {key: values[kept] for key, values in chunk.items() if key != 'tradeStatus'}
+
+        counts = cls._report(code, frequency, times, len(kept), masks, volume_spike)
+        return clean_chunk, counts
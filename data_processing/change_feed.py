@@ -0,0 +1,154 @@
+"""
+K线变更推送模块，每次提交一批K线后发布事件，供下游策略和告警进程增量消费
+"""
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+from bson import ObjectId
+
+from utils.logger import logger
+from config import config
+from db_operations.mongo_client import MongoClient
+
+class FileEventSink:
+    """本地追加日志事件通道，每行一个JSON事件，消费位置为文件字节偏移"""
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        Path(os.path.dirname(file_path) or '.').mkdir(parents=True, exist_ok=True)
+
+    def publish(self, event):
+        """以追加模式一次写入整行，多个进程同时发布时行不会交错"""
+        line = (json.dumps(event, ensure_ascii=False, default=str) + '\n').encode('utf-8')
+        fd = os.open(self.file_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def consume(self, position=None, follow=False, poll_interval=1.0):
+        """从指定字节偏移开始读取事件，返回(下一个位置, 事件)"""
+        position = int(position or 0)
+        while not os.path.exists(self.file_path):
+            if not follow:
+                return
+            time.sleep(poll_interval)
+
+        with open(self.file_path, 'rb') as f:
+            f.seek(position)
+            while True:
+                line = f.readline()
+                # 只消费完整的行，写了一半的行等下次再读
+                if not line.endswith(b'\n'):
+                    if not follow:
+                        return
+                    f.seek(position)
+                    time.sleep(poll_interval)
+                    continue
+                position = f.tell()
+                yield position, json.loads(line)
+
+class MongoEventSink:
+    """MongoDB事件通道，事件写入集合，消费方通过变更流和恢复令牌增量读取"""
+
+    def __init__(self, collection_name):
+        self.collection_name = collection_name
+
+    def publish(self, event):
+        """写入事件文档"""
+        MongoClient().insert_one(self.collection_name, dict(event))
+
+    def consume(self, position=None, follow=False):
+        """从恢复令牌之后读取事件，返回(消费位置, 事件)；变更流要求MongoDB为副本集
+
+        没有恢复令牌时先按 _id 顺序补读集合中已有的事件，消费位置为 {'afterId': ...}，
+        补读完后再读变更流，消费位置为恢复令牌
+        """
+        collection = MongoClient().get_collection(self.collection_name)
+        pipeline = [{'$match': {'operationType': 'insert'}}]
+        catch_up = position is None or 'afterId' in position
+        # 变更流打开前已有的最新事件，补读到比它更新的事件可能同时出现在变更流中
+        newest = collection.find_one(sort=[('_id', -1)], projection={'_id': 1}) if catch_up else None
+        # 先打开变更流再补读，补读期间新写入的事件不会遗漏
+        with collection.watch(pipeline, resume_after=None if catch_up else position) as stream:
+            seen = set()
+            if catch_up:
+                query = {'_id': {'$gt': ObjectId(position['afterId'])}} if position else {}
+                for event in collection.find(query).sort('_id', 1):
+                    event_id = event.pop('_id')
+                    # 只记住变更流打开后写入的事件，用于在变更流中去重
+                    if newest is None or event_id > newest['_id']:
+                        seen.add(event_id)
+                    yield {'afterId': str(event_id)}, event
+
+            while stream.alive:
+                change = stream.try_next()
+                if change is None:
+                    if not follow:
+                        return
+                    continue
+                event = change['fullDocument']
+                if event.pop('_id', None) in seen:
+                    continue
+                yield change['_id'], event
+
+class ChangeFeed:
+    """K线变更推送类，按配置选择事件通道，也可以通过 set_sink 接入自定义通道"""
+
+    SINKS = {
+        'file': lambda feed_config: FileEventSink(feed_config.get('file_path', 'logs/bar_events.jsonl')),
+        'mongodb': lambda feed_config: MongoEventSink(feed_config.get('collection', 'bar_events'))
+    }
+
+    _sink = None
+    _configured = False
+
+    @classmethod
+    def get_sink(cls):
+        """获取当前事件通道，未启用时返回None"""
+        if not cls._configured:
+            feed_config = config.get_change_feed_config()
+            sink_name = feed_config.get('sink', 'none')
+            if sink_name in cls.SINKS:
+                cls._sink = cls.SINKS[sink_name](feed_config)
+            elif sink_name != 'none':
+                raise ValueError(f"不支持的事件通道: {sink_name}")
+            cls._configured = True
+        return cls._sink
+
+    @classmethod
+    def set_sink(cls, sink):
+        """替换事件通道，sink需要提供publish和consume方法"""
+        cls._sink = sink
+        cls._configured = True
+
+    @classmethod
+    def publish(cls, code, frequency, bars):
+        """为一批已提交的K线发布事件；数据已写入，发布失败只记录日志"""
+        sink = cls.get_sink()
+        if not sink or not bars:
+            return
+        times = [bar['time'] for bar in bars]
+        event = {
+            'code': code,
+            'frequency': frequency,
+            'start': min(times),
+            'end': max(times),
+            'count': len(bars),
+            'publishedAt': datetime.now()
+        }
+        try:
+            sink.publish(event)
+        except Exception as e:
+            logger.error(f"发布股票 {code} 频率 {frequency} 的K线事件失败: {e}")
+
+    @classmethod
+    def consume(cls, position=None, follow=False):
+        """从消费位置之后读取事件，返回(下一个消费位置, 事件)"""
+        sink = cls.get_sink()
+        if not sink:
+            raise ValueError("未启用K线变更推送，请在配置中设置 change_feed.sink")
+        return sink.consume(position, follow)
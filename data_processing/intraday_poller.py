@@ -0,0 +1,111 @@
+"""
+盘中轮询模块，按关注标记优先刷新当前交易时段的小时线数据
+"""
+import heapq
+import time
+from datetime import datetime
+
+from utils.logger import logger
+from config import config
+from data_fetch import BaostockClient
+from db_operations.stock_model import StockModel
+from db_operations.snapshot_model import SnapshotModel
+from .bar_validator import BarValidator
+from .stock_processor import StockProcessor
+
+class IntradayPoller:
+    """盘中轮询类，星标和关注股票每轮必刷，其余股票使用剩余额度轮流刷新"""
+
+    # 优先级，数值越小越优先
+    PRIORITY_STAR = 0
+    PRIORITY_FOCUSED = 1
+    PRIORITY_NORMAL = 2
+
+    def __init__(self, interval_seconds=None, budget=None):
+        intraday_config = config.get_intraday_config()
+        self.interval_seconds = interval_seconds or intraday_config.get('interval_seconds', 300)
+        self.budget = budget or intraday_config.get('budget_per_cycle', 300)
+        self.trading_sessions = [
+            (datetime.strptime(start, '%H:%M').time(), datetime.strptime(end, '%H:%M').time())
+            for start, end in intraday_config.get('trading_sessions', [['09:30', '11:35'], ['13:00', '15:05']])
+        ]
+        # 每只股票最近一次刷新的时间戳，用于普通股票的轮转
+        self._last_refreshed = {}
+
+    def is_trading_time(self, now=None):
+        """判断当前是否处于交易时段"""
+        now = now or datetime.now()
+        if now.weekday() >= 5:
+            return False
+        return any(start <= now.time() <= end for start, end in self.trading_sessions)
+
+    @classmethod
+    def get_priority(cls, stock):
+        """根据关注标记计算股票的刷新优先级"""
+        if stock.get('isStar'):
+            return cls.PRIORITY_STAR
+        if stock.get('isFocused') or stock.get('isHourFocused'):
+            return cls.PRIORITY_FOCUSED
+        return cls.PRIORITY_NORMAL
+
+    def _build_queue(self):
+        """构建本轮的优先队列，同一优先级内最久未刷新的股票排在前面"""
+        stocks = StockModel.iter_stocks(
+            projection={'_id': 0, 'code': 1, 'isStar': 1, 'isFocused': 1, 'isHourFocused': 1}
+        )
+        queue = [
+            (self.get_priority(stock), self._last_refreshed.get(stock['code'], 0), stock['code'])
+            for stock in stocks
+        ]
+        heapq.heapify(queue)
+        return queue
+
+    def refresh_stock(self, code, session_date):
+        """拉取当前交易日的小时线，只追加数据库中尚未存在的新K线"""
+        last_time = StockModel.get_last_bar_time(code, 'hourLine')
+        hourly_data = BaostockClient().get_hourly_k_data(code, session_date, session_date)
+        # 盘中每次只有几条小时线，以快照中最近小时线的平均成交量为成交量异常的基准
+        baseline_volume = SnapshotModel.get_volume_baselines([code]).get(code, {}).get('60')
+        hourly_data, _ = BarValidator.validate(code, hourly_data, '60', baseline_volume=baseline_volume)
+        new_bars = [bar for bar in hourly_data if last_time is None or bar['time'] > last_time]
+        self._last_refreshed[code] = time.time()
+        count = StockModel.append_bars(code, 'hourLine', new_bars)
+        StockProcessor.after_commit(code, '60', new_bars)
+        return count
+
+    def poll_once(self):
+        """执行一轮轮询，返回本轮刷新的股票数和新增的K线数"""
+        session_date = datetime.now().strftime('%Y-%m-%d')
+        queue = self._build_queue()
+        refreshed = 0
+        bar_count = 0
+
+        while queue:
+            priority, _, code = heapq.heappop(queue)
+            # 关注股票不受额度限制，普通股票只使用剩余额度
+            if priority == self.PRIORITY_NORMAL and refreshed >= self.budget:
+                break
+            try:
+                bar_count += self.refresh_stock(code, session_date)
+            except Exception as e:
+                logger.error(f"刷新股票 {code} 盘中小时线失败: {e}")
+            refreshed += 1
+
+        logger.info(f"盘中轮询完成: 刷新 {refreshed} 只股票，新增 {bar_count} 条小时线数据")
+        return refreshed, bar_count
+
+    def run(self, once=False, ignore_trading_hours=False):
+        """按固定间隔持续轮询，非交易时段只等待不请求数据"""
+        logger.info(f"启动盘中轮询: 间隔 {self.interval_seconds} 秒，每轮额度 {self.budget} 只股票")
+        while True:
+            started = time.time()
+            if ignore_trading_hours or self.is_trading_time():
+                self.poll_once()
+            elif once:
+                logger.info("当前不在交易时段，跳过轮询")
+            else:
+                logger.debug("当前不在交易时段，等待下一轮")
+
+            if once:
+                return
+            time.sleep(max(0, self.interval_seconds - (time.time() - started)))
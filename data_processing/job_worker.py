@@ -0,0 +1,122 @@
+"""
+分布式任务工作进程模块，从任务队列领取批次并执行数据更新
+"""
+import os
+import socket
+import threading
+import time
+import uuid
+
+from utils.logger import logger
+from utils.memory import MemoryGuard
+from config import config
+from data_fetch import BaostockClient
+from db_operations.job_queue import JobQueue
+from .stock_processor import StockProcessor
+
+class LeaseLostError(Exception):
+    """批次租约已被其他工作进程接管"""
+
+class JobWorker:
+    """任务工作进程类，领取批次、维持心跳并逐只股票执行更新"""
+
+    HANDLERS = {
+        'update-daily': StockProcessor.process_daily_data,
+        'update-hourly': StockProcessor.process_hourly_data,
+        'update-adjust-factor': StockProcessor.process_adjust_factor
+    }
+
+    def __init__(self, job_id, worker_id=None, lease_seconds=None, heartbeat_interval=None):
+        queue_config = config.get_job_queue_config()
+        self.job_id = job_id
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.lease_seconds = lease_seconds or queue_config.get('lease_seconds', 300)
+        # 心跳间隔不超过租约的三分之一，保证租约在两次心跳之间不会过期
+        self.heartbeat_interval = min(
+            heartbeat_interval or queue_config.get('heartbeat_interval_seconds', 60),
+            self.lease_seconds / 3
+        )
+        self.idle_poll_seconds = queue_config.get('idle_poll_seconds', 10)
+
+    def run(self):
+        """循环领取并处理批次，直到任务没有可领取的批次，返回处理的记录总数"""
+        total_count = 0
+        batch_count = 0
+        logger.info(f"工作进程 {self.worker_id} 开始处理任务 {self.job_id}")
+
+        while True:
+            batch = JobQueue.claim_batch(self.job_id, self.worker_id, self.lease_seconds)
+            if not batch:
+                # 其他工作进程仍持有批次时等待，其租约过期后可重新领取
+                if JobQueue.has_active_batches(self.job_id):
+                    time.sleep(self.idle_poll_seconds)
+                    continue
+                break
+
+            try:
+                count = self._process_batch(batch)
+            except LeaseLostError as e:
+                logger.warning(f"工作进程 {self.worker_id} 放弃批次 {batch['batchNo']}: {e}")
+                continue
+            except Exception as e:
+                logger.error(f"工作进程 {self.worker_id} 处理批次 {batch['batchNo']} 失败: {e}")
+                JobQueue.fail_batch(batch['_id'], self.worker_id, e)
+                continue
+
+            if JobQueue.complete_batch(batch['_id'], self.worker_id, count):
+                total_count += count
+                batch_count += 1
+            else:
+                logger.warning(f"工作进程 {self.worker_id} 提交批次 {batch['batchNo']} 时租约已失效")
+
+        logger.info(
+            f"工作进程 {self.worker_id} 完成任务 {self.job_id}: 共处理 {batch_count} 个批次，{total_count} 条记录，"
+            f"峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB"
+        )
+        return total_count
+
+    def _process_batch(self, batch):
+        """在心跳线程维持租约的同时处理批次中的所有股票"""
+        handler = self.HANDLERS.get(batch['command'])
+        if not handler:
+            raise ValueError(f"不支持的任务命令: {batch['command']}")
+
+        params = batch.get('params', {})
+        stop_event = threading.Event()
+        lease_lost = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat_loop,
+            args=(batch['_id'], stop_event, lease_lost),
+            daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            count = 0
+            for code in batch['codes']:
+                # 租约丢失后立即停止，避免与接管批次的工作进程重复处理
+                if lease_lost.is_set():
+                    raise LeaseLostError(f"批次 {batch['batchNo']} 的租约已丢失")
+                count += handler(code, params.get('start_date'), params.get('end_date'))
+            return count
+        finally:
+            stop_event.set()
+            heartbeat.join()
+
+    def _heartbeat_loop(self, batch_id, stop_event, lease_lost):
+        """定期续约，续约失败时通知处理线程"""
+        while not stop_event.wait(self.heartbeat_interval):
+            try:
+                if not JobQueue.renew_lease(batch_id, self.worker_id, self.lease_seconds):
+                    lease_lost.set()
+                    return
+            except Exception as e:
+                logger.error(f"工作进程 {self.worker_id} 续约失败: {e}")
+
+    @staticmethod
+    def run_in_process(job_id, lease_seconds=None):
+        """在独立进程中运行工作进程，供本地多进程模式使用"""
+        try:
+            return JobWorker(job_id, lease_seconds=lease_seconds).run()
+        finally:
+            BaostockClient.logout()
@@ -0,0 +1,170 @@
+"""
+全市场矩阵模块，构建股票×日期的收盘价矩阵，计算收益率、滚动波动率和相关系数矩阵
+"""
+import json
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from utils.logger import logger
+from config import config
+from db_operations.mongo_client import MongoClient
+from db_operations.stock_model import StockModel
+
+class MarketMatrix:
+    """全市场矩阵类，价格矩阵以停牌为NaN对齐，大矩阵按块计算并写入磁盘映射文件以限制内存"""
+
+    def __init__(self, start_date, end_date, window=None, min_periods=None, block_size=None, cache_dir=None):
+        matrix_config = config.get_matrix_config()
+        self.start_date = start_date
+        self.end_date = end_date
+        self.window = window or matrix_config.get('window', 20)
+        self.min_periods = min_periods or matrix_config.get('min_periods', self.window)
+        self.block_size = block_size or matrix_config.get('block_size', 500)
+        self.cache_dir = Path(cache_dir or matrix_config.get('cache_dir', 'cache')) / f"matrix_{start_date}_{end_date}"
+
+    def load_prices_from_db(self):
+        """流式读取窗口内的日线收盘价，返回股票代码、日期和价格矩阵"""
+        start = datetime.strptime(self.start_date, '%Y-%m-%d')
+        end = datetime.strptime(self.end_date, '%Y-%m-%d')
+        # 服务端只截取窗口内的时间和收盘价，不传输整个日线数组
+        pipeline = [
+            {'$match': {'dayLineEnd': {'$gte': start}}},
+            {'$project': {
+                '_id': 0,
+                'code': 1,
+                'bars': {'$filter': {
+                    'input': '$dayLine',
+                    'as': 'bar',
+                    'cond': {'$and': [{'$gte': ['$$bar.time', start]}, {'$lte': ['$$bar.time', end]}]}
+                }}
+            }},
+            {'$project': {'code': 1, 'time': '$bars.time', 'close': '$bars.close'}},
+            {'$sort': {'code': 1}}
+        ]
+
+        codes, series = [], []
+        for stock in MongoClient().iter_aggregate(StockModel.COLLECTION_NAME, pipeline):
+            if not stock.get('time'):
+                continue
+            codes.append(stock['code'])
+            series.append((
+                np.array(stock['time'], dtype='datetime64[D]'),
+                np.array(stock['close'], dtype=np.float64)
+            ))
+
+        dates = np.unique(np.concatenate([times for times, _ in series])) if series else np.array([], dtype='datetime64[D]')
+        prices = np.full((len(codes), len(dates)), np.nan)
+        for row, (times, closes) in enumerate(series):
+            prices[row, np.searchsorted(dates, times)] = closes
+        # 非正价格视为无效，与停牌一样记为NaN
+        prices[prices <= 0] = np.nan
+        return codes, dates, prices
+
+    def load_prices(self, source='auto'):
+        """获取价格矩阵，auto优先使用本地缓存，db总是从数据库重建，cache只读缓存"""
+        cache_file = self.cache_dir / 'prices.npz'
+        if source in ('auto', 'cache') and cache_file.exists():
+            with np.load(cache_file) as data:
+                logger.info(f"从本地缓存加载价格矩阵: {cache_file}")
+                return list(data['codes']), data['dates'], data['prices']
+        if source == 'cache':
+            raise FileNotFoundError(f"价格矩阵缓存不存在: {cache_file}")
+
+        codes, dates, prices = self.load_prices_from_db()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        np.savez_compressed(cache_file, codes=np.array(codes), dates=dates, prices=prices)
+        return codes, dates, prices
+
+    @staticmethod
+    def compute_returns(prices):
+        """计算简单收益率，任一端为NaN时收益率为NaN"""
+        return prices[:, 1:] / prices[:, :-1] - 1
+
+    def compute_volatility(self, returns, output):
+        """按行块计算滚动标准差，有效样本数不足min_periods时为NaN"""
+        window = self.window
+        for start in range(0, returns.shape[0], self.block_size):
+            block = returns[start:start + self.block_size]
+            valid = ~np.isnan(block)
+            values = np.where(valid, block, 0.0)
+
+            # 用累计和在O(日期数)内得到每个窗口的样本数、和与平方和
+            def rolling_sum(array):
+                cumsum = np.cumsum(np.pad(array, ((0, 0), (1, 0))), axis=1)
+                result = cumsum[:, 1:].copy()
+                result[:, window:] -= cumsum[:, 1:-window]
+                return result
+
+            count = rolling_sum(valid.astype(np.float64))
+            total = rolling_sum(values)
+            total_sq = rolling_sum(values * values)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                variance = (total_sq - total * total / count) / (count - 1)
+            volatility = np.sqrt(np.clip(variance, 0, None))
+            volatility[count < max(self.min_periods, 2)] = np.nan
+            output[start:start + len(block)] = volatility
+
+    def compute_correlation(self, returns, output):
+        """按块计算两两重叠样本的相关系数，每次只在内存中保留两个行块的中间结果"""
+        valid = (~np.isnan(returns)).astype(np.float64)
+        values = np.where(valid > 0, returns, 0.0)
+        squares = values * values
+        rows = returns.shape[0]
+
+        for i in range(0, rows, self.block_size):
+            xi, mi, qi = values[i:i + self.block_size], valid[i:i + self.block_size], squares[i:i + self.block_size]
+            for j in range(i, rows, self.block_size):
+                xj, mj, qj = values[j:j + self.block_size], valid[j:j + self.block_size], squares[j:j + self.block_size]
+                n = mi @ mj.T
+                sx, sy = xi @ mj.T, mi @ xj.T
+                sxx, syy = qi @ mj.T, mi @ qj.T
+                sxy = xi @ xj.T
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    corr = (n * sxy - sx * sy) / np.sqrt((n * sxx - sx * sx) * (n * syy - sy * sy))
+                corr[n < self.min_periods] = np.nan
+                output[i:i + len(xi), j:j + len(xj)] = corr
+                output[j:j + len(xj), i:i + len(xi)] = corr.T
+
+    def build(self, source='auto', refresh=False):
+        """构建并缓存全部矩阵，返回各结果文件所在目录"""
+        meta_file = self.cache_dir / f"meta_w{self.window}_p{self.min_periods}.json"
+        if meta_file.exists() and not refresh:
+            logger.info(f"矩阵结果已存在，直接使用缓存: {self.cache_dir}")
+            return self.cache_dir
+
+        codes, dates, prices = self.load_prices('db' if refresh and source == 'auto' else source)
+        if len(codes) == 0 or len(dates) < 2:
+            raise ValueError(f"{self.start_date} 至 {self.end_date} 没有足够的日线数据")
+
+        returns = self.compute_returns(prices)
+        suffix = f"w{self.window}_p{self.min_periods}"
+        np.save(self.cache_dir / 'returns.npy', returns.astype(np.float32))
+
+        volatility = np.lib.format.open_memmap(
+            self.cache_dir / f'volatility_{suffix}.npy', mode='w+', dtype=np.float32, shape=returns.shape
+        )
+        self.compute_volatility(returns, volatility)
+        volatility.flush()
+
+        correlation = np.lib.format.open_memmap(
+            self.cache_dir / f'correlation_p{self.min_periods}.npy', mode='w+', dtype=np.float32,
+            shape=(len(codes), len(codes))
+        )
+        self.compute_correlation(returns, correlation)
+        correlation.flush()
+
+        with open(meta_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                'codes': list(codes),
+                'dates': [str(date) for date in dates],
+                'window': self.window,
+                'minPeriods': self.min_periods
+            }, f, ensure_ascii=False)
+
+        logger.info(
+            f"全市场矩阵构建完成: {len(codes)} 只股票 × {len(dates)} 个交易日，"
+            f"停牌/缺失占比 {np.isnan(prices).mean():.1%}，结果目录 {self.cache_dir}"
+        )
+        return self.cache_dir
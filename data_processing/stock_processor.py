@@ -2,14 +2,37 @@
 股票数据处理模块，负责处理和转换股票数据
 """
 from datetime import datetime, timedelta
-from utils.logger import logger
+from utils.logger import logger, EventAggregator
+from utils.memory import MemoryGuard
+from config import config
 from data_fetch import BaostockClient
 from db_operations.stock_model import StockModel
-from db_operations.mongo_client import MongoClient
+from db_operations.snapshot_model import SnapshotModel
+from .bar_validator import BarValidator
+from .change_feed import ChangeFeed
 
 class StockProcessor:
     """股票数据处理类，提供数据处理和转换功能"""
     
+    # 按时间逐条更新已有K线的方法
+    ROW_UPDATERS = {
+        'd': StockModel.update_day_line,
+        '60': StockModel.update_hour_line
+    }
+    
+    _memory_guard = None
+    
+    @staticmethod
+    def after_commit(code, frequency, bars):
+        """K线写入后紧接着更新截面快照，并发布变更事件；K线已写入，快照更新失败只记录日志"""
+        if not bars:
+            return
+        try:
+            SnapshotModel.update(code, frequency, bars)
+        except Exception as e:
+            logger.error(f"更新股票 {code} 频率 {frequency} 的截面快照失败: {e}")
+        ChangeFeed.publish(code, frequency, bars)
+    
     @staticmethod
     def process_stock_list():
         """处理股票列表数据并保存到数据库"""
@@ -28,139 +51,278 @@ class StockProcessor:
             logger.error(f"处理股票列表数据失败: {e}")
             raise
     
-    @staticmethod
-    def process_daily_data(code, start_date=None, end_date=None):
+    @classmethod
+    def get_memory_guard(cls):
+        """获取本进程共用的内存上限控制器"""
+        if cls._memory_guard is None:
+            cls._memory_guard = MemoryGuard()
+        return cls._memory_guard
+    
+    @classmethod
+    def iter_clean_bars(cls, code, frequency, start_date=None, end_date=None, adjustflag='3', baseline_volume=None):
+        """分块获取并校验K线，每次返回一个分块的有效K线，内存中只保留当前分块
+
+        baseline_volume 为已保存K线的平均成交量，分块太小时作为成交量异常放大的基准
+        """
+        baostock_client = BaostockClient()
+        guard = cls.get_memory_guard()
+        previous_end = None
+        for chunk in baostock_client.iter_k_data_chunks(code, frequency, start_date, end_date, adjustflag, guard):
+            chunk_end = chunk['time'].max()
+            # 带上上一分块的最后时间，跨分块边界的重复K线也能被剔除
+            chunk, _ = BarValidator.validate_chunk(
+                code, chunk, frequency, adjusted=adjustflag != '3', after=previous_end,
+                baseline_volume=baseline_volume
+            )
+            previous_end = chunk_end if previous_end is None else max(previous_end, chunk_end)
+            bars = baostock_client.chunk_to_bars(chunk)
+            del chunk
+            if bars:
+                yield bars
+    
+    @classmethod
+    def process_k_data(cls, code, frequency, start_date=None, end_date=None):
+        """分块处理股票K线数据并保存到数据库
         
-        """处理股票日线数据并保存到数据库"""
+        晚于已有最后一条K线的数据逐块追加，不晚于的逐条按时间更新，返回处理的K线数量
+        """
+        name = BaostockClient.FREQUENCY_NAMES[frequency]
+        field = StockModel.line_field(frequency)
+        update_line = cls.ROW_UPDATERS[frequency]
         try:
-            # 检查股票是否存在
-            stock = StockModel.get_stock_by_code(code)
+            # 检查股票是否存在，只读取最后一条K线
+            stock = StockModel.get_stock_by_code(code, StockModel.last_bar_projection([field]))
             if not stock:
-                logger.warning(f"股票 {code} 不存在，无法保存日线数据")
+                logger.warning(f"股票 {code} 不存在，无法保存{name}线数据")
                 return 0
-                
-            # 如果数据库中已有日线数据且未指定开始日期，则从最后一条日线数据的日期开始获取
-            if not start_date and stock.get('dayLine') and len(stock['dayLine']) > 0:
-                # 获取最后一条日线数据的日期
-                last_date = stock['dayLine'][-1]['time']
-                start_date = (last_date).strftime('%Y-%m-%d')
-                logger.info(f"从最后一条日线数据日期 {last_date.strftime('%Y-%m-%d')} 后开始获取新数据")
+            last_time = stock[field][-1]['time'] if stock.get(field) else None
             
-            # 如果未指定日期，默认获取最近一年的数据
+            # 如果数据库中已有数据且未指定开始日期，则从最后一条数据的日期开始获取
+            if not start_date and last_time:
+                start_date = last_time.strftime('%Y-%m-%d')
+                logger.info(f"从最后一条{name}线数据日期 {start_date} 后开始获取新数据")
+            
+            # 如果未指定日期，默认获取到今天的数据
             if not end_date:
                 end_date = datetime.now().strftime('%Y-%m-%d')
             # 如果开始日期大于结束日期，则此股票已是最新数据
             if start_date and end_date and start_date > end_date:
-                logger.info(f"股票 {code} 的日线数据已是最新，无需更新")
-                return 0
-
-            # 获取股票日线数据
-            baostock_client = BaostockClient()
-            daily_data = baostock_client.get_daily_k_data(code, start_date, end_date)
-            
-            # 检查股票是否存在
-            stock = StockModel.get_stock_by_code(code)
-            if not stock:
-                logger.warning(f"股票 {code} 不存在，无法保存日线数据")
+                logger.info(f"股票 {code} 的{name}线数据已是最新，无需更新")
                 return 0
             
-            # 保存到数据库
-            if start_date:
-                # 如果指定了开始日期，逐条更新数据
-                for data in daily_data:
-                    StockModel.update_day_line(code, data)
-            else:
-                # 如果没有指定开始日期，批量插入数据
-                if daily_data:
-                    mongo_client = MongoClient()
-                    mongo_client.update_one(
-                        StockModel.COLLECTION_NAME,
-                        {'code': code},
-                        {'$set': {'dayLine': daily_data}}
-                    )
-                    logger.info(f"批量更新股票 {code} 的日线数据，共 {len(daily_data)} 条记录")
+            total_count = 0
+            events = EventAggregator()
+            baseline_volume = SnapshotModel.get_volume_baselines([code]).get(code, {}).get(frequency)
+            for bars in cls.iter_clean_bars(code, frequency, start_date, end_date, baseline_volume=baseline_volume):
+                # 已有时间范围内的数据逐条更新
+                for data in bars:
+                    if last_time is not None and data['time'] <= last_time:
+                        events.record(code, update_line(code, data))
+                new_bars = [data for data in bars if last_time is None or data['time'] > last_time]
+                if new_bars:
+                    StockModel.append_bars(code, field, new_bars)
+                    last_time = new_bars[-1]['time']
+                    events.record(code, 'inserted', len(new_bars))
+                cls.after_commit(code, frequency, bars)
+                total_count += len(bars)
+            events.flush(code, f"{name}线数据更新汇总")
             
-            logger.info(f"成功处理并保存股票 {code} 的 {len(daily_data)} 条日线数据")
-            return len(daily_data)
+            logger.info(f"成功处理并保存股票 {code} 的 {total_count} 条{name}线数据")
+            return total_count
         except Exception as e:
-            logger.error(f"处理股票 {code} 日线数据失败: {e}")
+            logger.error(f"处理股票 {code} {name}线数据失败: {e}")
             raise
     
+    @staticmethod
+    def process_daily_data(code, start_date=None, end_date=None):
+        """处理股票日线数据并保存到数据库"""
+        return StockProcessor.process_k_data(code, 'd', start_date, end_date)
+    
     @staticmethod
     def process_hourly_data(code, start_date=None, end_date=None):
         """处理股票小时线数据并保存到数据库"""
-        try:
-            # 检查股票是否存在
-            stock = StockModel.get_stock_by_code(code)
-            if not stock:
-                logger.warning(f"股票 {code} 不存在，无法保存小时数据")
-                return 0
-                
-            # 如果数据库中已有小时线数据且未指定开始日期，则从最后一条小时线数据的日期开始获取
-            if not start_date and stock.get('hourLine') and len(stock['hourLine']) > 0:
-                # 获取最后一条小时线数据的日期
-                last_date = stock['hourLine'][-1]['time']
-                start_date = (last_date).strftime('%Y-%m-%d')
-                logger.info(f"从最后一条小时线数据日期 {last_date.strftime('%Y-%m-%d')} 后开始获取新数据")
-            
-            # 如果未指定日期，默认获取最近一年的数据
-            if not end_date:
-                end_date = datetime.now().strftime('%Y-%m-%d')
-            # 如果开始日期大于结束日期，则此股票已是最新数据
-            if start_date and end_date and start_date > end_date:
-                logger.info(f"股票 {code} 的小时线数据已是最新，无需更新")
-                return 0
-
-            # 获取股票小时线数据
-            baostock_client = BaostockClient()
-            hourly_data = baostock_client.get_hourly_k_data(code, start_date, end_date)
+        return StockProcessor.process_k_data(code, '60', start_date, end_date)
+    
+    @staticmethod
+    def commit_new_bars(code, frequency, field, bars, adjustflag='3'):
+        """直接追加一批新K线，返回写入的数量"""
+        count = StockModel.append_bars(code, field, bars)
+        # 快照和变更事件只针对不复权数据
+        if adjustflag == '3':
+            StockProcessor.after_commit(code, frequency, bars)
+        return count
+    
+    @staticmethod
+    def fetch_new_bars(stock, frequencies, adjustflag='3', start_date=None, end_date=None, baselines=None):
+        """获取单只股票多个频率的新K线，stock需带有各K线数组的最后一条数据，
+        baselines 为快照中各频率的平均成交量
+        
+        新K线只有一个分块时返回给调用方与其他频率合并写入；超过一个分块时（如首次获取全部历史）
+        逐块直接写入，不在内存中累积。返回 ({频率: 待合并写入的新K线}, 已直接写入的K线数量)
+        """
+        code = stock['code']
+        new_bars = {}
+        streamed = 0
+        for frequency in frequencies:
+            field = StockModel.line_field(frequency, adjustflag)
+            last_time = stock[field][-1]['time'] if stock.get(field) else None
+            # 已有数据时从最后一条K线所在日期开始获取，该日已保存的K线在下面过滤掉
+            fetch_start = last_time.strftime('%Y-%m-%d') if last_time else start_date
+            if fetch_start and end_date and fetch_start > end_date:
+                continue
             
-            # 检查股票是否存在
-            stock = StockModel.get_stock_by_code(code)
-            if not stock:
-                logger.warning(f"股票 {code} 不存在，无法保存小时线数据")
-                return 0
-            if start_date:
-                # 如果指定了开始日期，逐条更新数据
-                for data in hourly_data:
-                    StockModel.update_hour_line(code, data)
-            else:
-                # 如果没有指定开始日期，批量插入数据
-                if hourly_data:
-                    mongo_client = MongoClient()
-                    mongo_client.update_one(
-                        StockModel.COLLECTION_NAME,
-                        {'code': code},
-                        {'$set': {'hourLine': hourly_data}}
+            pending = None
+            chunk_count = 0
+            baseline_volume = (baselines or {}).get(frequency)
+            for bars in StockProcessor.iter_clean_bars(code, frequency, fetch_start, end_date, adjustflag, baseline_volume):
+                bars = [bar for bar in bars if last_time is None or bar['time'] > last_time]
+                if not bars:
+                    continue
+                last_time = bars[-1]['time']
+                if pending:
+                    streamed += StockProcessor.commit_new_bars(code, frequency, field, pending, adjustflag)
+                pending = bars
+                chunk_count += 1
+            if chunk_count > 1:
+                streamed += StockProcessor.commit_new_bars(code, frequency, field, pending, adjustflag)
+            elif pending:
+                new_bars[frequency] = pending
+        return new_bars, streamed
+    
+    @staticmethod
+    def commit_batch(operations, committed, rebuilt, adjustflag='3'):
+        """一次批量写入多只股票的新K线，committed为 [(代码, {频率: 新K线})]，返回写入的K线数量"""
+        StockModel.bulk_update(operations)
+        # 复权数组写入完成后才清除标记，中途失败时下次运行会重新获取
+        for stock_code in rebuilt:
+            StockModel.clear_adjust_cache_stale(stock_code)
+        count = sum(len(bars) for _, new_bars in committed for bars in new_bars.values())
+        # 快照和变更事件只针对不复权数据
+        if adjustflag != '3':
+            return count
+        # 整批股票的快照更新紧接着K线一次批量写入，写入完成后再发布变更事件
+        try:
+            SnapshotModel.apply([
+                SnapshotModel.build_update(stock_code, frequency, bars)
+                for stock_code, new_bars in committed
+                for frequency, bars in new_bars.items()
+                if bars and frequency in SnapshotModel.PREFIXES
+            ])
+        except Exception as e:
+            # K线已写入，快照可用 rebuild-snapshots 重建，变更事件照常发布
+            logger.error(f"批量更新 {len(committed)} 只股票的截面快照失败: {e}")
+        for stock_code, new_bars in committed:
+            for frequency, bars in new_bars.items():
+                ChangeFeed.publish(stock_code, frequency, bars)
+        return count
+    
+    @staticmethod
+    def process_update(frequencies=None, adjustflag=None, code=None, start_date=None, end_date=None):
+        """一次遍历股票更新多个频率的K线
+        
+        每批股票用一次查询读出各频率的最后一条K线，每只股票的全部频率合并为一个更新操作，
+        多只股票再合并批量写入，待写入的K线达到一个分块或内存超过上限时提前写入；
+        超过一个分块的长历史逐块直接写入。复权数据在复权因子变化后
+        （adjustCacheStale）整体重新获取。返回 (写入的K线数量, 失败的股票数量)
+        """
+        update_config = config.get_update_config()
+        frequencies = frequencies or update_config.get('frequencies', ['d', '60'])
+        adjustflag = adjustflag or update_config.get('adjustflag', '3')
+        end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+        fields = {frequency: StockModel.line_field(frequency, adjustflag) for frequency in frequencies}
+        
+        query = {'code': code} if code else None
+        projection = StockModel.last_bar_projection(fields.values())
+        adjusted = adjustflag != '3'
+        if adjusted:
+            projection['adjustCacheStale'] = 1
+        guard = StockProcessor.get_memory_guard()
+        total_count = 0
+        failed = 0
+        for batch in StockModel.iter_stock_batches(query, projection):
+            # 每批股票一次查询读出快照中的平均成交量，作为增量K线成交量异常的基准
+            baselines = SnapshotModel.get_volume_baselines(stock['code'] for stock in batch)
+            operations = []
+            committed = []
+            rebuilt = []
+            pending_count = 0
+            stock_count = 0
+            for stock in batch:
+                try:
+                    if adjusted and stock.get('adjustCacheStale'):
+                        # 复权因子变化后已保存的复权价格整体失效（前复权会改写全部历史），
+                        # 删除全部复权数组后重新获取本次请求的频率，其余频率下次请求时再完整获取
+                        StockModel.clear_adjusted_bars(stock['code'])
+                        stock = {'code': stock['code']}
+                        rebuilt.append(stock['code'])
+                        logger.info(f"股票 {stock['code']} 复权因子已变化，重新获取复权K线")
+                    new_bars, streamed = StockProcessor.fetch_new_bars(
+                        stock, frequencies, adjustflag, start_date, end_date, baselines.get(stock['code'])
                     )
-                    logger.info(f"批量更新股票 {code} 的小时线数据，共 {len(hourly_data)} 条记录")
+                    total_count += streamed
+                except Exception as e:
+                    logger.error(f"获取股票 {stock['code']} 的K线数据失败: {e}")
+                    failed += 1
+                    if stock['code'] in rebuilt:
+                        rebuilt.remove(stock['code'])
+                    continue
+                operation = StockModel.build_append(
+                    stock['code'], {fields[frequency]: bars for frequency, bars in new_bars.items()}
+                )
+                if operation:
+                    operations.append(operation)
+                    committed.append((stock['code'], new_bars))
+                    pending_count += sum(len(bars) for bars in new_bars.values())
+                
+                # 待写入的K线达到一个分块或常驻内存超过上限时提前写入，内存占用不随批次大小增长
+                if pending_count >= guard.chunk_size or guard.check() > guard.limit:
+                    total_count += StockProcessor.commit_batch(operations, committed, rebuilt, adjustflag)
+                    stock_count += len(committed)
+                    operations, committed, rebuilt = [], [], []
+                    pending_count = 0
             
-            logger.info(f"成功处理并保存股票 {code} 的 {len(hourly_data)} 条小时线数据")
-            return len(hourly_data)
-        except Exception as e:
-            logger.error(f"处理股票 {code} 小时线数据失败: {e}")
-            raise
+            total_count += StockProcessor.commit_batch(operations, committed, rebuilt, adjustflag)
+            stock_count += len(committed)
+            logger.info(f"本批 {len(batch)} 只股票更新完成，其中 {stock_count} 只有新K线")
+        
+        if code and failed:
+            raise Exception(f"股票 {code} 更新失败")
+        return total_count, failed
     
     @staticmethod
     def process_adjust_factor(code, start_date=None, end_date=None):
-        """处理股票复权因子数据并保存到数据库"""
+        """增量处理股票复权因子数据，只批量写入新增或变化的因子"""
         try:
+            # 检查股票是否存在，同时读取已保存的复权因子
+            stored_factors = StockModel.get_adjust_factors(code)
+            if stored_factors is None:
+                logger.warning(f"股票 {code} 不存在，无法保存复权因子数据")
+                return 0
+            
+            # 未指定开始日期时从已保存的最新因子日期开始获取，该日因子用于核对是否有变化
+            if not start_date and stored_factors:
+                start_date = max(factor['time'] for factor in stored_factors).strftime('%Y-%m-%d')
+            
             # 获取股票复权因子数据
             baostock_client = BaostockClient()
             adjust_factor_data = baostock_client.get_adjust_factor(code, start_date, end_date)
             
-            # 检查股票是否存在
-            stock = StockModel.get_stock_by_code(code)
-            if not stock:
-                logger.warning(f"股票 {code} 不存在，无法保存复权因子数据")
-                return 0
-            
-            # 保存到数据库
-            for data in adjust_factor_data:
-                StockModel.update_adjust_factor(code, data)
+            stored_by_time = {factor['time']: factor for factor in stored_factors}
+            new_factors = [data for data in adjust_factor_data if data['time'] not in stored_by_time]
+            changed_factors = [
+                data for data in adjust_factor_data
+                if data['time'] in stored_by_time and any(
+                    stored_by_time[data['time']].get(key) != value for key, value in data.items()
+                )
+            ]
             
-            logger.info(f"成功处理并保存股票 {code} 的 {len(adjust_factor_data)} 条复权因子数据")
-            return len(adjust_factor_data)
+            # 保存到数据库，有新因子时标记需要重建复权价格缓存
+            count = StockModel.upsert_adjust_factors(code, new_factors, changed_factors)
+            if count:
+                logger.info(f"股票 {code} 新增 {len(new_factors)} 条、修正 {len(changed_factors)} 条复权因子，已标记需重建复权缓存")
+            else:
+                logger.info(f"股票 {code} 的复权因子数据已是最新，无需更新")
+            return count
         except Exception as e:
             logger.error(f"处理股票 {code} 复权因子数据失败: {e}")
             raise
\ No newline at end of file
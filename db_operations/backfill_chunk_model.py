@@ -0,0 +1,145 @@
+"""
+历史回补分片模型，记录每个分片的状态，支持中断后续跑和单独重试
+"""
+from datetime import datetime, timedelta
+
+from .mongo_client import MongoClient
+from utils.logger import logger
+from config import config
+
+class BackfillChunkModel:
+    """历史回补分片模型类，提供分片的登记、领取和状态更新"""
+
+    COLLECTION_NAME = 'backfill_chunks'
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    @classmethod
+    def setup_indexes(cls):
+        """设置集合索引"""
+        mongo_client = MongoClient()
+        mongo_client.create_index(
+            cls.COLLECTION_NAME,
+            [('code', 1), ('frequency', 1), ('start', 1), ('end', 1)],
+            unique=True
+        )
+        mongo_client.create_index(cls.COLLECTION_NAME, [('frequency', 1), ('status', 1), ('attempts', 1)])
+        logger.info(f"为 {cls.COLLECTION_NAME} 集合创建索引: code+frequency+start+end, frequency+status+attempts")
+
+    @classmethod
+    def has_open_chunks(cls, code, frequency):
+        """检查股票是否还有未完成的分片"""
+        mongo_client = MongoClient()
+        return mongo_client.count_documents(
+            cls.COLLECTION_NAME,
+            {'code': code, 'frequency': frequency, 'status': {'$ne': cls.STATUS_DONE}}
+        ) > 0
+
+    @classmethod
+    def remove_done(cls, code, frequency):
+        """删除股票已完成的分片，重新规划时相同区间的分片按新分片重新获取，返回删除的数量"""
+        mongo_client = MongoClient()
+        return mongo_client.delete_many(
+            cls.COLLECTION_NAME,
+            {'code': code, 'frequency': frequency, 'status': cls.STATUS_DONE}
+        )
+
+    @classmethod
+    def add_chunk(cls, code, frequency, start, end, after=None, before=None):
+        """登记分片，已存在的分片保持原状态；after/before 限定提交时保留的K线时间范围"""
+        mongo_client = MongoClient()
+        mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'code': code, 'frequency': frequency, 'start': start, 'end': end},
+            {'$setOnInsert': {
+                'after': after,
+                'before': before,
+                'status': cls.STATUS_PENDING,
+                'attempts': 0,
+                'createdAt': datetime.now()
+            }},
+            upsert=True
+        )
+
+    @classmethod
+    def reset_unfinished(cls, frequency, code=None):
+        """将上次运行中断遗留或已失败的分片恢复为待处理，失败分片重新计算尝试次数
+
+        只处理本次规划的股票；运行中的分片领取时间超过 running_timeout_seconds 才视为中断遗留，
+        避免把其他正在执行的回补进程手上的分片重复获取
+        """
+        mongo_client = MongoClient()
+        timeout = config.get_backfill_config().get('running_timeout_seconds', 1800)
+        query = {'frequency': frequency}
+        if code:
+            query['code'] = code
+        mongo_client.update_many(
+            cls.COLLECTION_NAME,
+            {
+                **query,
+                'status': cls.STATUS_RUNNING,
+                '$or': [
+                    {'claimedAt': {'$lt': datetime.now() - timedelta(seconds=timeout)}},
+                    {'claimedAt': {'$exists': False}}
+                ]
+            },
+            {'$set': {'status': cls.STATUS_PENDING}}
+        )
+        mongo_client.update_many(
+            cls.COLLECTION_NAME,
+            {**query, 'status': cls.STATUS_FAILED},
+            {'$set': {'status': cls.STATUS_PENDING, 'attempts': 0}}
+        )
+
+    @classmethod
+    def claim_chunk(cls, frequency, code=None):
+        """原子地领取一个待处理分片，无可领取分片时返回None"""
+        mongo_client = MongoClient()
+        query = {'frequency': frequency, 'status': cls.STATUS_PENDING}
+        if code:
+            query['code'] = code
+        return mongo_client.find_one_and_update(
+            cls.COLLECTION_NAME,
+            query,
+            {'$set': {'status': cls.STATUS_RUNNING, 'claimedAt': datetime.now()}, '$inc': {'attempts': 1}},
+            # 优先处理重试次数少的分片，让不同股票和分片交错执行
+            sort=[('attempts', 1), ('start', 1)]
+        )
+
+    @classmethod
+    def mark_done(cls, chunk_id, bar_count):
+        """标记分片已提交"""
+        mongo_client = MongoClient()
+        mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'_id': chunk_id},
+            {'$set': {'status': cls.STATUS_DONE, 'barCount': bar_count, 'finishedAt': datetime.now()}}
+        )
+
+    @classmethod
+    def mark_failed(cls, chunk, error):
+        """记录分片失败，未超过最大尝试次数时重新进入待处理状态"""
+        mongo_client = MongoClient()
+        max_attempts = config.get_backfill_config().get('max_attempts', 3)
+        status = cls.STATUS_FAILED if chunk.get('attempts', 0) >= max_attempts else cls.STATUS_PENDING
+        mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'_id': chunk['_id']},
+            {'$set': {'status': status, 'lastError': str(error)}}
+        )
+        return status
+
+    @classmethod
+    def count_by_status(cls, frequency, code=None):
+        """统计各状态的分片数量"""
+        mongo_client = MongoClient()
+        query = {'frequency': frequency}
+        if code:
+            query['code'] = code
+        return {
+            status: mongo_client.count_documents(cls.COLLECTION_NAME, {**query, 'status': status})
+            for status in (cls.STATUS_PENDING, cls.STATUS_RUNNING, cls.STATUS_DONE, cls.STATUS_FAILED)
+        }
@@ -0,0 +1,60 @@
+"""
+数据质量模型，记录每只股票校验发现问题的K线时间和数量
+"""
+from .mongo_client import MongoClient
+from utils.logger import logger
+
+class DataQualityModel:
+    """数据质量模型类，按股票和频率合并校验结果"""
+
+    COLLECTION_NAME = 'data_quality'
+
+    @classmethod
+    def setup_indexes(cls):
+        """设置集合索引"""
+        mongo_client = MongoClient()
+        mongo_client.create_index(cls.COLLECTION_NAME, [('code', 1), ('frequency', 1)], unique=True)
+        logger.info(f"为 {cls.COLLECTION_NAME} 集合创建索引: code+frequency")
+
+    @classmethod
+    def record(cls, code, frequency, issue_times):
+        """合并一批数据的校验结果
+
+        每个校验项保存出问题的K线时间并去重，计数取去重后的数量，同一条K线被重复获取和校验时不会重复计数
+        """
+        issue_times = {check: times for check, times in issue_times.items() if times}
+        if not issue_times:
+            return
+        mongo_client = MongoClient()
+        merge = {
+            f'issues.{check}': {'$setUnion': [{'$ifNull': [f'$issues.{check}', []]}, {'$literal': times}]}
+            for check, times in issue_times.items()
+        }
+        counts = {f'counts.{check}': {'$size': f'$issues.{check}'} for check in issue_times}
+        mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'code': code, 'frequency': frequency},
+            [
+                {'$set': merge},
+                {'$set': {**counts, 'lastCheckedAt': '$$NOW'}}
+            ],
+            upsert=True
+        )
+
+    @classmethod
+    def get_report(cls, code, frequency):
+        """获取股票指定频率的校验结果"""
+        mongo_client = MongoClient()
+        return mongo_client.find_one(cls.COLLECTION_NAME, {'code': code, 'frequency': frequency})
+
+    @classmethod
+    def top_reports(cls, frequency, check, limit=20):
+        """按指定校验项的问题数量列出问题最多的股票"""
+        mongo_client = MongoClient()
+        return mongo_client.find(
+            cls.COLLECTION_NAME,
+            {'frequency': frequency, f'counts.{check}': {'$gt': 0}},
+            projection={'_id': 0, 'code': 1, 'counts': 1, 'lastCheckedAt': 1},
+            sort=[(f'counts.{check}', -1)],
+            limit=limit
+        )
@@ -0,0 +1,140 @@
+"""
+索引布局基准测试模块，在临时集合上对比旧版和当前索引布局的读写开销
+"""
+import random
+import time
+from datetime import datetime, timedelta
+
+from .mongo_client import MongoClient
+from .stock_model import StockModel
+from utils.logger import logger
+
+class IndexBenchmark:
+    """索引布局基准测试类，使用合成数据测量追加K线、代码查找、关注筛选和最新日期查询的耗时"""
+
+    COLLECTION_NAME = 'bench_index_layout'
+
+    # 旧版单字段索引的键
+    LEGACY_KEYS = [
+        'code', 'name', 'market', 'isFocused', 'isHourFocused', 'focusedDays',
+        'hourFocusedDays', 'isStar', 'dayLine.time', 'hourLine.time'
+    ]
+
+    @classmethod
+    def _build_bars(cls, start, count, step):
+        """生成合成K线"""
+        return [
+            {
+                'time': start + step * i,
+                'open': 10.0, 'high': 10.5, 'low': 9.5, 'close': 10.2,
+                'volume': 100000.0, 'amount': 1020000.0
+            }
+            for i in range(count)
+        ]
+
+    @classmethod
+    def _populate(cls, stock_count, bar_count):
+        """写入合成股票文档"""
+        mongo_client = MongoClient()
+        day_start = datetime(2000, 1, 3)
+        documents = []
+        for i in range(stock_count):
+            day_line = cls._build_bars(day_start, bar_count, timedelta(days=1))
+            hour_line = cls._build_bars(day_start, bar_count, timedelta(hours=1))
+            documents.append({
+                'code': f'bench.{i:06d}',
+                'name': f'bench{i}',
+                'market': '1',
+                'isFocused': i % 20 == 0,
+                'isHourFocused': i % 25 == 0,
+                'focusedDays': i % 7,
+                'hourFocusedDays': i % 5,
+                'isStar': i % 50 == 0,
+                'dayLine': day_line,
+                'hourLine': hour_line,
+                'dayLineEnd': day_line[-1]['time'],
+                'hourLineEnd': hour_line[-1]['time'],
+                'adjustFactor': []
+            })
+            if len(documents) >= 50:
+                mongo_client.insert_many(cls.COLLECTION_NAME, documents)
+                documents = []
+        if documents:
+            mongo_client.insert_many(cls.COLLECTION_NAME, documents)
+
+    @classmethod
+    def _apply_layout(cls, layout):
+        """在临时集合上建立指定的索引布局，返回建索引耗时（秒）"""
+        mongo_client = MongoClient()
+        started = time.perf_counter()
+        if layout == 'legacy':
+            for key in cls.LEGACY_KEYS:
+                mongo_client.create_index(cls.COLLECTION_NAME, [(key, 1)])
+        else:
+            StockModel.setup_indexes(cls.COLLECTION_NAME)
+        return time.perf_counter() - started
+
+    @classmethod
+    def _measure(cls, operations, func):
+        """执行指定次数的操作，返回每次操作的平均耗时（毫秒）"""
+        started = time.perf_counter()
+        for i in range(operations):
+            func(i)
+        return (time.perf_counter() - started) / operations * 1000
+
+    @classmethod
+    def run_layout(cls, layout, stock_count, bar_count, operations):
+        """在一种索引布局下执行全部测试项"""
+        mongo_client = MongoClient()
+        collection = mongo_client.get_collection(cls.COLLECTION_NAME)
+        mongo_client.drop_collection(cls.COLLECTION_NAME)
+        cls._populate(stock_count, bar_count)
+
+        results = {'建索引(秒)': cls._apply_layout(layout)}
+        rng = random.Random(42)
+        codes = [f'bench.{rng.randrange(stock_count):06d}' for _ in range(operations)]
+        next_time = datetime(2000, 1, 3) + timedelta(days=bar_count)
+
+        def append_bar(i):
+            bar = cls._build_bars(next_time + timedelta(minutes=i), 1, timedelta(days=1))[0]
+            collection.update_one(
+                {'code': codes[i]},
+                {'$push': {'dayLine': bar}, '$max': {'dayLineEnd': bar['time']}}
+            )
+
+        def lookup(i):
+            collection.find_one({'code': codes[i]}, {'_id': 0, 'code': 1, 'isFocused': 1})
+
+        def focus_screen(i):
+            list(collection.find({'isFocused': True}, {'_id': 0, 'code': 1}))
+
+        def latest_date(i):
+            if layout == 'legacy':
+                list(collection.find({}, {'_id': 0, 'dayLine.time': 1}).sort('dayLine.time', -1).limit(1))
+            else:
+                list(collection.find({'dayLineEnd': {'$exists': True}}, {'_id': 0, 'dayLineEnd': 1})
+                     .sort('dayLineEnd', -1).limit(1))
+
+        results['追加K线(毫秒/次)'] = cls._measure(operations, append_bar)
+        results['代码查找(毫秒/次)'] = cls._measure(operations, lookup)
+        results['关注筛选(毫秒/次)'] = cls._measure(max(operations // 10, 1), focus_screen)
+        results['最新日期(毫秒/次)'] = cls._measure(max(operations // 10, 1), latest_date)
+        stats = mongo_client.collection_stats(cls.COLLECTION_NAME)
+        results['索引总大小(MB)'] = stats.get('totalIndexSize', 0) / 1024 / 1024
+        return results
+
+    @classmethod
+    def run(cls, stock_count=200, bar_count=2000, operations=500):
+        """对比旧版和当前索引布局，返回各布局的测试结果"""
+        results = {}
+        try:
+            for layout in ('legacy', 'current'):
+                results[layout] = cls.run_layout(layout, stock_count, bar_count, operations)
+        finally:
+            MongoClient().drop_collection(cls.COLLECTION_NAME)
+
+        for name in results['legacy']:
+            logger.info(
+                f"索引基准 {name}: 旧版 {results['legacy'][name]:.3f}，当前 {results['current'][name]:.3f}"
+            )
+        return results
@@ -0,0 +1,211 @@
+"""
+分布式任务队列模块，基于MongoDB租约实现多节点批次分发
+"""
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from .mongo_client import MongoClient
+from utils.logger import logger
+from config import config
+
+class JobQueue:
+    """任务队列类，将股票代码拆分为批次，工作进程通过带过期时间的租约领取批次"""
+
+    COLLECTION_NAME = 'job_batches'
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    @staticmethod
+    def _now():
+        """获取当前UTC时间，保证不同时区的节点比较租约时一致"""
+        return datetime.now(timezone.utc)
+
+    @classmethod
+    def setup_indexes(cls):
+        """设置集合索引"""
+        mongo_client = MongoClient()
+        mongo_client.create_index(cls.COLLECTION_NAME, [('jobId', 1), ('batchNo', 1)], unique=True)
+        mongo_client.create_index(cls.COLLECTION_NAME, [('jobId', 1), ('status', 1), ('leaseExpiresAt', 1)])
+        logger.info(f"为 {cls.COLLECTION_NAME} 集合创建索引: jobId+batchNo, jobId+status+leaseExpiresAt")
+
+    @classmethod
+    def create_job(cls, command, codes, params=None, job_id=None, batch_size=None):
+        """创建任务，将股票代码按批次写入队列，返回任务ID"""
+        queue_config = config.get_job_queue_config()
+        batch_size = batch_size or queue_config.get('batch_size', 50)
+        job_id = job_id or f"{command}-{datetime.now().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:6]}"
+
+        created_at = cls._now()
+        batch_no = 0
+        code_count = 0
+        batch_codes = []
+        # 逐批写入，股票代码可以是流式迭代器
+        for code in codes:
+            batch_codes.append(code)
+            code_count += 1
+            if len(batch_codes) >= batch_size:
+                cls._insert_batch(job_id, batch_no, command, params, batch_codes, created_at)
+                batch_no += 1
+                batch_codes = []
+        if batch_codes:
+            cls._insert_batch(job_id, batch_no, command, params, batch_codes, created_at)
+            batch_no += 1
+
+        logger.info(f"创建任务 {job_id}: 共 {code_count} 只股票，拆分为 {batch_no} 个批次")
+        return job_id
+
+    @classmethod
+    def _insert_batch(cls, job_id, batch_no, command, params, codes, created_at):
+        """写入单个待处理批次"""
+        MongoClient().insert_one(cls.COLLECTION_NAME, {
+            'jobId': job_id,
+            'batchNo': batch_no,
+            'command': command,
+            'params': params or {},
+            'codes': codes,
+            'status': cls.STATUS_PENDING,
+            'owner': None,
+            'leaseExpiresAt': None,
+            'attempts': 0,
+            'createdAt': created_at
+        })
+
+    @classmethod
+    def fail_exhausted(cls, job_id):
+        """将租约已过期且已达到最大尝试次数的批次标记为失败，返回标记的批次数量
+        
+        持有者在最后一次尝试中崩溃或丢失租约时，批次不能再被领取，需要在这里结束，
+        否则会一直停留在运行状态
+        """
+        mongo_client = MongoClient()
+        max_attempts = config.get_job_queue_config().get('max_attempts', 3)
+        count = mongo_client.update_many(
+            cls.COLLECTION_NAME,
+            {
+                'jobId': job_id,
+                'status': cls.STATUS_RUNNING,
+                'attempts': {'$gte': max_attempts},
+                'leaseExpiresAt': {'$lt': cls._now()}
+            },
+            {'$set': {
+                'status': cls.STATUS_FAILED,
+                'owner': None,
+                'leaseExpiresAt': None,
+                'lastError': f'第 {max_attempts} 次尝试的租约过期'
+            }}
+        )
+        if count:
+            logger.warning(f"任务 {job_id} 有 {count} 个批次达到最大尝试次数后租约过期，已标记为失败")
+        return count
+
+    @classmethod
+    def claim_batch(cls, job_id, worker_id, lease_seconds):
+        """原子地领取一个待处理或租约已过期的批次，无可领取批次时返回None"""
+        mongo_client = MongoClient()
+        max_attempts = config.get_job_queue_config().get('max_attempts', 3)
+        cls.fail_exhausted(job_id)
+        now = cls._now()
+
+        batch = mongo_client.find_one_and_update(
+            cls.COLLECTION_NAME,
+            {
+                'jobId': job_id,
+                'attempts': {'$lt': max_attempts},
+                '$or': [
+                    {'status': cls.STATUS_PENDING},
+                    {'status': cls.STATUS_RUNNING, 'leaseExpiresAt': {'$lt': now}}
+                ]
+            },
+            {
+                '$set': {
+                    'status': cls.STATUS_RUNNING,
+                    'owner': worker_id,
+                    'leaseExpiresAt': now + timedelta(seconds=lease_seconds),
+                    'heartbeatAt': now
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('batchNo', 1)]
+        )
+
+        if batch:
+            logger.info(f"工作进程 {worker_id} 领取任务 {job_id} 的批次 {batch['batchNo']} (第 {batch['attempts']} 次尝试)")
+        return batch
+
+    @classmethod
+    def renew_lease(cls, batch_id, worker_id, lease_seconds):
+        """续约批次租约，租约已被其他工作进程接管时返回False"""
+        mongo_client = MongoClient()
+        now = cls._now()
+        modified = mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'_id': batch_id, 'owner': worker_id, 'status': cls.STATUS_RUNNING},
+            {'$set': {
+                'leaseExpiresAt': now + timedelta(seconds=lease_seconds),
+                'heartbeatAt': now
+            }}
+        )
+        return modified > 0
+
+    @classmethod
+    def complete_batch(cls, batch_id, worker_id, processed_count):
+        """标记批次完成，只有当前租约持有者可以提交"""
+        mongo_client = MongoClient()
+        modified = mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'_id': batch_id, 'owner': worker_id, 'status': cls.STATUS_RUNNING},
+            {'$set': {
+                'status': cls.STATUS_DONE,
+                'leaseExpiresAt': None,
+                'processedCount': processed_count,
+                'finishedAt': cls._now()
+            }}
+        )
+        return modified > 0
+
+    @classmethod
+    def fail_batch(cls, batch_id, worker_id, error):
+        """释放失败的批次，未超过最大尝试次数时重新进入待处理状态"""
+        mongo_client = MongoClient()
+        max_attempts = config.get_job_queue_config().get('max_attempts', 3)
+        batch = mongo_client.find_one(cls.COLLECTION_NAME, {'_id': batch_id, 'owner': worker_id})
+        if not batch:
+            return False
+
+        status = cls.STATUS_FAILED if batch.get('attempts', 0) >= max_attempts else cls.STATUS_PENDING
+        modified = mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'_id': batch_id, 'owner': worker_id, 'status': cls.STATUS_RUNNING},
+            {'$set': {
+                'status': status,
+                'owner': None,
+                'leaseExpiresAt': None,
+                'lastError': str(error)
+            }}
+        )
+        return modified > 0
+
+    @classmethod
+    def has_active_batches(cls, job_id):
+        """检查任务是否仍有运行中的批次；租约过期且不能再领取的批次先标记为失败，不计入其中"""
+        mongo_client = MongoClient()
+        cls.fail_exhausted(job_id)
+        return mongo_client.count_documents(
+            cls.COLLECTION_NAME,
+            {'jobId': job_id, 'status': cls.STATUS_RUNNING}
+        ) > 0
+
+    @classmethod
+    def get_job_status(cls, job_id):
+        """统计任务各状态的批次数量"""
+        mongo_client = MongoClient()
+        status = {}
+        for state in (cls.STATUS_PENDING, cls.STATUS_RUNNING, cls.STATUS_DONE, cls.STATUS_FAILED):
+            status[state] = mongo_client.count_documents(
+                cls.COLLECTION_NAME,
+                {'jobId': job_id, 'status': state}
+            )
+        return status
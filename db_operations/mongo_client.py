@@ -2,7 +2,7 @@
 MongoDB客户端模块，提供数据库连接和操作功能
 """
 import time
-from pymongo import MongoClient as PyMongoClient
+from pymongo import MongoClient as PyMongoClient, ReturnDocument
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
 
 from utils.logger import logger
@@ -87,10 +87,10 @@ class MongoClient:
         return result.inserted_ids
     
     @classmethod
-    def find_one(cls, collection_name, query=None):
+    def find_one(cls, collection_name, query=None, projection=None):
         """查找单个文档"""
         collection = cls.get_collection(collection_name)
-        return collection.find_one(query or {})
+        return collection.find_one(query or {}, projection)
     
     @classmethod
     def find(cls, collection_name, query=None, projection=None, sort=None, limit=0, skip=0):
@@ -107,6 +107,34 @@ class MongoClient:
             
         return list(cursor)
     
+    @classmethod
+    def iter_find(cls, collection_name, query=None, projection=None, sort=None, batch_size=None):
+        """流式查找多个文档，游标按批次从服务器拉取，逐个返回文档"""
+        collection = cls.get_collection(collection_name)
+        batch_size = batch_size or config.get_mongodb_config().get('cursor_batch_size', 500)
+        cursor = collection.find(query or {}, projection).batch_size(batch_size)
+        if sort:
+            cursor = cursor.sort(sort)
+        
+        try:
+            for document in cursor:
+                yield document
+        finally:
+            cursor.close()
+    
+    @classmethod
+    def iter_batches(cls, collection_name, query=None, projection=None, sort=None, batch_size=None):
+        """流式查找多个文档，每次返回固定数量文档组成的列表"""
+        batch_size = batch_size or config.get_mongodb_config().get('cursor_batch_size', 500)
+        batch = []
+        for document in cls.iter_find(collection_name, query, projection, sort, batch_size):
+            batch.append(document)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
     @classmethod
     def update_one(cls, collection_name, query, update, upsert=False):
         """更新单个文档"""
@@ -114,6 +142,24 @@ class MongoClient:
         result = collection.update_one(query, update, upsert=upsert)
         return result.modified_count
     
+    @classmethod
+    def find_one_and_update(cls, collection_name, query, update, sort=None, upsert=False, return_new=True):
+        """原子地查找并更新单个文档，默认返回更新后的文档"""
+        collection = cls.get_collection(collection_name)
+        return collection.find_one_and_update(
+            query,
+            update,
+            sort=sort,
+            upsert=upsert,
+            return_document=ReturnDocument.AFTER if return_new else ReturnDocument.BEFORE
+        )
+    
+    @classmethod
+    def bulk_write(cls, collection_name, operations, ordered=False):
+        """批量执行写操作"""
+        collection = cls.get_collection(collection_name)
+        return collection.bulk_write(operations, ordered=ordered)
+    
     @classmethod
     def update_many(cls, collection_name, query, update, upsert=False):
         """更新多个文档"""
@@ -147,6 +193,47 @@ class MongoClient:
         collection = cls.get_collection(collection_name)
         return collection.create_index(keys, **kwargs)
     
+    @classmethod
+    def index_information(cls, collection_name):
+        """获取集合现有索引，键为索引名"""
+        collection = cls.get_collection(collection_name)
+        return collection.index_information()
+    
+    @classmethod
+    def drop_index(cls, collection_name, index_name):
+        """删除索引"""
+        collection = cls.get_collection(collection_name)
+        collection.drop_index(index_name)
+    
+    @classmethod
+    def aggregate(cls, collection_name, pipeline):
+        """执行聚合管道"""
+        collection = cls.get_collection(collection_name)
+        return list(collection.aggregate(pipeline))
+    
+    @classmethod
+    def iter_aggregate(cls, collection_name, pipeline, batch_size=None):
+        """流式执行聚合管道，游标按批次从服务器拉取，逐个返回结果"""
+        collection = cls.get_collection(collection_name)
+        batch_size = batch_size or config.get_mongodb_config().get('cursor_batch_size', 500)
+        with collection.aggregate(pipeline, batchSize=batch_size, allowDiskUse=True) as cursor:
+            for document in cursor:
+                yield document
+    
+    @classmethod
+    def collection_stats(cls, collection_name):
+        """获取集合统计信息，包括各索引大小"""
+        if cls._db is None:
+            cls._connect()
+        return cls._db.command('collStats', collection_name)
+    
+    @classmethod
+    def drop_collection(cls, collection_name):
+        """删除集合"""
+        if cls._db is None:
+            cls._connect()
+        cls._db.drop_collection(collection_name)
+    
     @classmethod
     def close(cls):
         """关闭数据库连接"""
@@ -0,0 +1,170 @@
+"""
+截面快照模型，每只股票一条小文档，保存最近N条日线和小时线及预计算的收益率
+"""
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from .mongo_client import MongoClient
+from .stock_model import StockModel
+from utils.logger import logger
+from config import config
+
+class SnapshotModel:
+    """截面快照模型类，全市场筛选只需在快照集合上做一次索引查询"""
+
+    COLLECTION_NAME = 'stock_snapshots'
+
+    # 频率对应的快照字段前缀
+    PREFIXES = {
+        'd': 'day',
+        '60': 'hour'
+    }
+
+    BAR_FIELDS = ('time', 'open', 'high', 'low', 'close', 'volume', 'amount')
+
+    # 可用于全市场筛选的指标
+    METRICS = ('dayReturn', 'dayVolumeRatio', 'hourReturn', 'hourVolumeRatio')
+
+    @classmethod
+    def setup_indexes(cls):
+        """设置集合索引"""
+        mongo_client = MongoClient()
+        mongo_client.create_index(cls.COLLECTION_NAME, [('code', 1)], unique=True)
+        for metric in cls.METRICS:
+            mongo_client.create_index(cls.COLLECTION_NAME, [(metric, -1)])
+        logger.info(f"为 {cls.COLLECTION_NAME} 集合创建索引: code, {', '.join(cls.METRICS)}")
+
+    @classmethod
+    def get_bar_count(cls):
+        """获取快照中每个频率保留的K线数量"""
+        return config.get_snapshot_config().get('bars', 20)
+
+    @classmethod
+    def build_update(cls, code, frequency, bars):
+        """构造快照的更新操作，服务端合并最近N条K线并重新计算指标，不需要先读取快照"""
+        prefix = cls.PREFIXES[frequency]
+        field = f'{prefix}Bars'
+        keep = cls.get_bar_count()
+        new_bars = sorted(
+            ({key: bar[key] for key in cls.BAR_FIELDS} for bar in bars),
+            key=lambda bar: bar['time']
+        )[-keep:]
+        existing = {'$ifNull': [f'${field}', []]}
+
+        return UpdateOne(
+            {'code': code},
+            [
+                {'$set': {field: {'$cond': [
+                    # 回补的历史分片早于快照窗口时保持不变
+                    {'$gte': [new_bars[-1]['time'], {'$ifNull': [{'$max': f'${field}.time'}, new_bars[0]['time']]}]},
+                    {'$slice': [{'$concatArrays': [
+                        {'$filter': {
+                            'input': existing,
+                            'as': 'bar',
+                            'cond': {'$lt': ['$$bar.time', new_bars[0]['time']]}
+                        }},
+                        {'$literal': new_bars}
+                    ]}, -keep]},
+                    existing
+                ]}}},
+                {'$set': {
+                    f'{prefix}Time': {'$arrayElemAt': [f'${field}.time', -1]},
+                    f'{prefix}Close': {'$arrayElemAt': [f'${field}.close', -1]},
+                    f'{prefix}Return': {'$let': {
+                        'vars': {
+                            'last': {'$arrayElemAt': [f'${field}.close', -1]},
+                            'prev': {'$arrayElemAt': [f'${field}.close', -2]}
+                        },
+                        'in': {'$cond': [
+                            {'$gt': ['$$prev', 0]},
+                            {'$subtract': [{'$divide': ['$$last', '$$prev']}, 1]},
+                            None
+                        ]}
+                    }},
+                    # 最新成交量相对窗口内此前K线平均成交量的倍数
+                    f'{prefix}VolumeRatio': {'$let': {
+                        'vars': {
+                            'last': {'$arrayElemAt': [f'${field}.volume', -1]},
+                            'avg': {'$avg': {'$slice': [
+                                f'${field}.volume', 0, {'$max': [{'$subtract': [{'$size': f'${field}'}, 1]}, 1]}
+                            ]}}
+                        },
+                        'in': {'$cond': [
+                            {'$and': [{'$gt': [{'$size': f'${field}'}, 1]}, {'$gt': ['$$avg', 0]}]},
+                            {'$divide': ['$$last', '$$avg']},
+                            None
+                        ]}
+                    }},
+                    'updatedAt': '$$NOW'
+                }}
+            ],
+            upsert=True
+        )
+
+    @classmethod
+    def update(cls, code, frequency, bars):
+        """用新提交的K线更新单只股票的快照"""
+        if not bars or frequency not in cls.PREFIXES:
+            return
+        cls.apply([cls.build_update(code, frequency, bars)])
+
+    @classmethod
+    def apply(cls, operations):
+        """批量执行快照更新操作"""
+        if operations:
+            MongoClient().bulk_write(cls.COLLECTION_NAME, operations)
+
+    @classmethod
+    def get_volume_baselines(cls, codes):
+        """一次查询多只股票快照中最近N条K线的平均成交量，返回 {代码: {频率: 平均成交量}}"""
+        projection = {'_id': 0, 'code': 1, **{f'{prefix}Bars.volume': 1 for prefix in cls.PREFIXES.values()}}
+        baselines = {}
+        for snapshot in MongoClient().find(cls.COLLECTION_NAME, {'code': {'$in': list(codes)}}, projection):
+            baselines[snapshot['code']] = {}
+            for frequency, prefix in cls.PREFIXES.items():
+                volumes = [bar['volume'] for bar in snapshot.get(f'{prefix}Bars', []) if bar.get('volume', 0) > 0]
+                if volumes:
+                    baselines[snapshot['code']][frequency] = sum(volumes) / len(volumes)
+        return baselines
+
+    @classmethod
+    def rebuild(cls, batch_size=None):
+        """根据股票集合中最近N条K线重建全部快照，返回处理的股票数量"""
+        keep = cls.get_bar_count()
+        count = 0
+        projection = {'code': 1, 'dayLine': {'$slice': -keep}, 'hourLine': {'$slice': -keep}}
+        for batch in StockModel.iter_stock_batches(projection=projection, batch_size=batch_size):
+            operations = []
+            for stock in batch:
+                for frequency, field in (('d', 'dayLine'), ('60', 'hourLine')):
+                    if stock.get(field):
+                        operations.append(cls.build_update(stock['code'], frequency, stock[field]))
+            cls.apply(operations)
+            count += len(batch)
+        logger.info(f"重建 {count} 只股票的截面快照")
+        return count
+
+    @classmethod
+    def screen(cls, metric, top=20, ascending=False, query=None, date=None):
+        """按指标筛选全市场股票，走指标索引一次查询完成
+
+        只比较最新K线落在指定交易日（默认为最新交易日）的股票，停牌股票的旧指标不参与排名
+        """
+        if metric not in cls.METRICS:
+            raise ValueError(f"不支持的筛选指标: {metric}")
+        time_field = 'dayTime' if metric.startswith('day') else 'hourTime'
+        day = datetime.strptime(date, '%Y-%m-%d') if date else StockModel.get_latest_trading_date()
+        filters = {**(query or {}), metric: {'$ne': None}}
+        if day:
+            day = datetime(day.year, day.month, day.day)
+            filters[time_field] = {'$gte': day, '$lt': day + timedelta(days=1)}
+
+        mongo_client = MongoClient()
+        return mongo_client.find(
+            cls.COLLECTION_NAME,
+            filters,
+            projection={'_id': 0, 'dayBars': 0, 'hourBars': 0},
+            sort=[(metric, 1 if ascending else -1)],
+            limit=top
+        )
@@ -2,36 +2,164 @@
 股票数据模型，定义MongoDB集合结构和操作方法
 """
 from datetime import datetime
+from pymongo import UpdateOne
 from .mongo_client import MongoClient
 from utils.logger import logger
+from config import config
 
 class StockModel:
     """股票数据模型类，提供股票数据的存储和查询功能"""
     
     COLLECTION_NAME = 'stocks'
     
+    # K线数组对应的最新K线时间字段，按时间的范围查询走这些标量索引，不再维护整个数组的多键索引
+    WATERMARK_FIELDS = {
+        'dayLine': 'dayLineEnd',
+        'hourLine': 'hourLineEnd'
+    }
+    
+    # 各频率K线对应的数组字段
+    LINE_FIELDS = {
+        'd': 'dayLine',
+        'w': 'weekLine',
+        'm': 'monthLine',
+        '5': 'min5Line',
+        '15': 'min15Line',
+        '30': 'min30Line',
+        '60': 'hourLine'
+    }
+    
+    # 复权方式对应的字段后缀，不复权数据沿用原字段名
+    ADJUST_SUFFIXES = {
+        '3': '',
+        '2': 'Fore',
+        '1': 'Back'
+    }
+    
+    # 按实际访问模式设计的索引：代码查找、按最新K线时间的范围查询、关注股票筛选
+    INDEXES = [
+        {'name': 'code_unique', 'keys': [('code', 1)], 'unique': True},
+        {'name': 'dayLineEnd_1', 'keys': [('dayLineEnd', 1)]},
+        {'name': 'hourLineEnd_1', 'keys': [('hourLineEnd', 1)]},
+        {'name': 'isStar_true', 'keys': [('isStar', 1), ('code', 1)],
+         'partialFilterExpression': {'isStar': True}},
+        {'name': 'isFocused_true', 'keys': [('isFocused', 1), ('focusedDays', -1)],
+         'partialFilterExpression': {'isFocused': True}},
+        {'name': 'isHourFocused_true', 'keys': [('isHourFocused', 1), ('hourFocusedDays', -1)],
+         'partialFilterExpression': {'isHourFocused': True}},
+        {'name': 'adjustCacheStale_true', 'keys': [('adjustCacheStale', 1)],
+         'partialFilterExpression': {'adjustCacheStale': True}}
+    ]
+    
+    # 旧版本创建的单字段索引，迁移时在新索引建好后删除
+    LEGACY_INDEXES = [
+        'code_1', 'name_1', 'market_1', 'isFocused_1', 'isHourFocused_1', 'focusedDays_1',
+        'hourFocusedDays_1', 'isStar_1', 'dayLine.time_1', 'hourLine.time_1'
+    ]
+    
     @classmethod
-    def setup_indexes(cls):
-        """设置集合索引"""
+    def setup_indexes(cls, collection_name=None):
+        """设置集合索引，并安全迁移旧版本的索引"""
         mongo_client = MongoClient()
+        collection_name = collection_name or cls.COLLECTION_NAME
         
-        # 创建索引
-        indexes = [
-            ('code', 1),
-            ('name', 1),
-            ('market', 1),
-            ('isFocused', 1),
-            ('isHourFocused', 1),
-            ('focusedDays', 1),
-            ('hourFocusedDays', 1),
-            ('isStar', 1),
-            ('dayLine.time', 1),
-            ('hourLine.time', 1)
-        ]
+        # 先为已有数据补齐最新K线时间字段
+        cls.backfill_watermarks(collection_name)
         
-        for field, direction in indexes:
-            mongo_client.create_index(cls.COLLECTION_NAME, [(field, direction)])
-            logger.info(f"为 {cls.COLLECTION_NAME} 集合创建索引: {field}")
+        existing = mongo_client.index_information(collection_name)
+        for index in cls.INDEXES:
+            if index['name'] in existing:
+                continue
+            options = {key: value for key, value in index.items() if key != 'keys'}
+            if index.get('unique') and 'code_1' in existing:
+                # 唯一索引与旧索引键相同，确认没有重复代码后才替换旧索引
+                duplicates = mongo_client.aggregate(collection_name, [
+                    {'$group': {'_id': '$code', 'count': {'$sum': 1}}},
+                    {'$match': {'count': {'$gt': 1}}},
+                    {'$limit': 5}
+                ])
+                if duplicates:
+                    logger.error(f"{collection_name} 集合存在重复股票代码 {[d['_id'] for d in duplicates]}，保留旧索引 code_1")
+                    continue
+                # 相同键的索引不能同时存在，先删除旧索引
+                mongo_client.drop_index(collection_name, 'code_1')
+                existing.pop('code_1')
+            try:
+                mongo_client.create_index(collection_name, index['keys'], **options)
+            except Exception as e:
+                if not index.get('unique'):
+                    raise
+                # 唯一索引建立失败（如期间并发写入了重复代码）时恢复普通代码索引，集合不会失去代码索引
+                logger.error(f"为 {collection_name} 集合创建索引 {index['name']} 失败，使用普通索引 code_1: {e}")
+                mongo_client.create_index(collection_name, [('code', 1)], name='code_1')
+                continue
+            logger.info(f"为 {collection_name} 集合创建索引: {index['name']}")
+        
+        for name in cls.LEGACY_INDEXES:
+            # 唯一索引未能建立时保留旧的代码索引
+            if name == 'code_1' and 'code_unique' not in mongo_client.index_information(collection_name):
+                continue
+            if name in existing:
+                mongo_client.drop_index(collection_name, name)
+                logger.info(f"删除 {collection_name} 集合的旧索引: {name}")
+    
+    @classmethod
+    def line_field(cls, frequency, adjustflag='3'):
+        """获取指定频率和复权方式的K线数组字段名"""
+        if frequency not in cls.LINE_FIELDS:
+            raise ValueError(f"不支持的K线频率: {frequency}")
+        if adjustflag not in cls.ADJUST_SUFFIXES:
+            raise ValueError(f"不支持的复权方式: {adjustflag}")
+        return cls.LINE_FIELDS[frequency] + cls.ADJUST_SUFFIXES[adjustflag]
+    
+    @classmethod
+    def watermark_field(cls, field):
+        """获取K线数组对应的最新K线时间字段，非K线数组返回None"""
+        if field in cls.WATERMARK_FIELDS:
+            return cls.WATERMARK_FIELDS[field]
+        if any(field == line + suffix for line in cls.LINE_FIELDS.values() for suffix in cls.ADJUST_SUFFIXES.values()):
+            return f'{field}End'
+        return None
+    
+    @classmethod
+    def adjusted_fields(cls):
+        """获取全部复权K线数组字段名"""
+        return [
+            line + suffix
+            for line in cls.LINE_FIELDS.values()
+            for suffix in cls.ADJUST_SUFFIXES.values() if suffix
+        ]
+    
+    @classmethod
+    def backfill_watermarks(cls, collection_name=None):
+        """为缺少最新K线时间字段的文档补齐该字段"""
+        mongo_client = MongoClient()
+        collection_name = collection_name or cls.COLLECTION_NAME
+        for field, watermark in cls.WATERMARK_FIELDS.items():
+            count = mongo_client.update_many(
+                collection_name,
+                {watermark: {'$exists': False}, f'{field}.0': {'$exists': True}},
+                [{'$set': {watermark: {'$max': f'${field}.time'}}}]
+            )
+            if count:
+                logger.info(f"为 {count} 只股票补齐 {watermark} 字段")
+    
+    @classmethod
+    def index_usage_report(cls, collection_name=None):
+        """统计集合各索引的访问次数和大小"""
+        mongo_client = MongoClient()
+        collection_name = collection_name or cls.COLLECTION_NAME
+        sizes = mongo_client.collection_stats(collection_name).get('indexSizes', {})
+        report = []
+        for stats in mongo_client.aggregate(collection_name, [{'$indexStats': {}}]):
+            report.append({
+                'name': stats['name'],
+                'key': dict(stats['key']),
+                'ops': stats['accesses']['ops'],
+                'since': stats['accesses']['since'],
+                'size': sizes.get(stats['name'], 0)
+            })
+        return sorted(report, key=lambda item: item['ops'])
     
     @classmethod
     def save_stock(cls, stock_data):
@@ -51,7 +179,7 @@ class StockModel:
                     update_data['$set'][key] = value
             
             mongo_client.update_one(cls.COLLECTION_NAME, {'code': stock_data['code']}, update_data)
-            logger.debug(f"更新股票信息: {stock_data['code']} - {stock_data.get('name', '')}")
+            logger.debug("更新股票信息: {} - {}", stock_data['code'], stock_data.get('name', ''))
             return existing_stock['_id']
         else:
             # 创建新股票记录
@@ -68,7 +196,7 @@ class StockModel:
     
     @classmethod
     def update_day_line(cls, code, day_line_data):
-        """更新股票日线数据"""
+        """更新股票日线数据，返回本次是更新(updated)还是新增(inserted)"""
         mongo_client = MongoClient()
         
         # 检查日线数据是否已存在
@@ -90,19 +218,22 @@ class StockModel:
                 },
                 {'$set': {'dayLine.$': day_line_data}}
             )
-            logger.debug(f"更新股票日线数据: {code}, 日期: {day_line_data['time']}")
+            return 'updated'
         else:
             # 添加新的日线数据
             mongo_client.update_one(
                 cls.COLLECTION_NAME,
                 {'code': code},
-                {'$push': {'dayLine': day_line_data}}
+                {
+                    '$push': {'dayLine': day_line_data},
+                    '$max': {cls.WATERMARK_FIELDS['dayLine']: day_line_data['time']}
+                }
             )
-            logger.debug(f"添加股票日线数据: {code}, 日期: {day_line_data['time']}")
+            return 'inserted'
     
     @classmethod
     def update_hour_line(cls, code, hour_line_data):
-        """更新股票小时线数据"""
+        """更新股票小时线数据，返回本次是更新(updated)还是新增(inserted)"""
         mongo_client = MongoClient()
         
         # 检查小时线数据是否已存在
@@ -124,55 +255,175 @@ class StockModel:
                 },
                 {'$set': {'hourLine.$': hour_line_data}}
             )
-            logger.debug(f"更新股票小时线数据: {code}, 时间: {hour_line_data['time']}")
+            return 'updated'
         else:
             # 添加新的小时线数据
             mongo_client.update_one(
                 cls.COLLECTION_NAME,
                 {'code': code},
-                {'$push': {'hourLine': hour_line_data}}
+                {
+                    '$push': {'hourLine': hour_line_data},
+                    '$max': {cls.WATERMARK_FIELDS['hourLine']: hour_line_data['time']}
+                }
             )
-            logger.debug(f"添加股票小时线数据: {code}, 时间: {hour_line_data['time']}")
+            return 'inserted'
+    
+    @classmethod
+    def get_adjust_factors(cls, code):
+        """获取股票已保存的复权因子，股票不存在时返回None"""
+        mongo_client = MongoClient()
+        stock = mongo_client.find_one(cls.COLLECTION_NAME, {'code': code}, {'_id': 0, 'adjustFactor': 1})
+        if stock is None:
+            return None
+        return stock.get('adjustFactor', [])
+    
+    @classmethod
+    def upsert_adjust_factors(cls, code, new_factors, changed_factors):
+        """在一次批量写入中追加新因子、修正已变化的因子，并标记复权价格缓存需要重建，返回写入的因子数量"""
+        if not new_factors and not changed_factors:
+            return 0
+        mongo_client = MongoClient()
+        operations = [
+            UpdateOne(
+                {'code': code},
+                {'$set': {'adjustFactor.$[factor]': factor}},
+                array_filters=[{'factor.time': factor['time']}]
+            )
+            for factor in changed_factors
+        ]
+        if new_factors:
+            operations.append(UpdateOne(
+                {'code': code},
+                {'$push': {'adjustFactor': {'$each': new_factors, '$sort': {'time': 1}}}}
+            ))
+        operations.append(UpdateOne(
+            {'code': code},
+            {'$set': {'adjustCacheStale': True, 'adjustFactorChangedAt': datetime.now()}}
+        ))
+        mongo_client.bulk_write(cls.COLLECTION_NAME, operations, ordered=True)
+        return len(new_factors) + len(changed_factors)
+    
+    @classmethod
+    def count_adjust_cache_stale(cls):
+        """统计需要重建复权价格缓存的股票数量"""
+        mongo_client = MongoClient()
+        return mongo_client.count_documents(cls.COLLECTION_NAME, {'adjustCacheStale': True})
+    
+    @classmethod
+    def clear_adjusted_bars(cls, code):
+        """删除股票全部复权K线数组及其最新K线时间字段"""
+        mongo_client = MongoClient()
+        unset = {}
+        for field in cls.adjusted_fields():
+            unset[field] = ''
+            unset[cls.watermark_field(field)] = ''
+        mongo_client.update_one(cls.COLLECTION_NAME, {'code': code}, {'$unset': unset})
+    
+    @classmethod
+    def clear_adjust_cache_stale(cls, code):
+        """复权价格缓存重建完成后清除标记"""
+        mongo_client = MongoClient()
+        mongo_client.update_one(cls.COLLECTION_NAME, {'code': code}, {'$unset': {'adjustCacheStale': ''}})
+    
+    @classmethod
+    def get_last_bar_time(cls, code, field):
+        """获取股票指定K线数组最后一条数据的时间，只投影最后一个元素"""
+        mongo_client = MongoClient()
+        stock = mongo_client.find_one(cls.COLLECTION_NAME, {'code': code}, cls.last_bar_projection([field]))
+        if stock and stock.get(field):
+            return stock[field][-1]['time']
+        return None
     
     @classmethod
-    def update_adjust_factor(cls, code, adjust_factor_data):
-        """更新股票复权因子数据"""
+    def get_first_bar_time(cls, code, field):
+        """获取股票指定K线数组第一条数据的时间，只投影第一个元素"""
         mongo_client = MongoClient()
+        stock = mongo_client.find_one(
+            cls.COLLECTION_NAME,
+            {'code': code},
+            {'_id': 0, 'code': 1, field: {'$slice': 1}}
+        )
+        if stock and stock.get(field):
+            return stock[field][0]['time']
+        return None
+    
+    @classmethod
+    def last_bar_projection(cls, fields):
+        """构造只取各K线数组最后一个元素的投影，$slice需要和包含型字段一起使用才不会返回整个文档"""
+        projection = {'_id': 0, 'code': 1}
+        for field in fields:
+            projection[field] = {'$slice': -1}
+        return projection
+    
+    @classmethod
+    def append_bars(cls, code, field, bars):
+        """将按时间排序的新K线数据一次性追加到指定数组"""
+        if not bars:
+            return 0
+        mongo_client = MongoClient()
+        mongo_client.update_one(
+            cls.COLLECTION_NAME,
+            {'code': code},
+            cls._push_update(field, bars)
+        )
+        return len(bars)
+    
+    @classmethod
+    def build_append(cls, code, bars_by_field):
+        """构造一次追加多个K线数组的更新操作，各数组的最新K线时间字段一并推进，没有新K线时返回None"""
+        update = {}
+        for field, bars in bars_by_field.items():
+            if not bars:
+                continue
+            for operator, values in cls._push_update(field, bars).items():
+                update.setdefault(operator, {}).update(values)
+        if not update:
+            return None
+        return UpdateOne({'code': code}, update)
+    
+    @classmethod
+    def bulk_update(cls, operations):
+        """批量执行股票文档的更新操作"""
+        if operations:
+            MongoClient().bulk_write(cls.COLLECTION_NAME, operations)
+    
+    @classmethod
+    def commit_chunk(cls, code, field, bars):
+        """幂等地提交一个历史分片
         
-        # 检查复权因子数据是否已存在
-        existing_stock = mongo_client.find_one(
-            cls.COLLECTION_NAME, 
+        分片之间可能乱序提交，写入时按时间重新排序数组；数组中已有该时间范围的K线时不再写入，
+        因此分片重试不会产生重复数据。返回实际写入的K线数量
+        """
+        if not bars:
+            return 0
+        mongo_client = MongoClient()
+        modified = mongo_client.update_one(
+            cls.COLLECTION_NAME,
             {
                 'code': code,
-                'adjustFactor.time': adjust_factor_data['time']
-            }
+                field: {'$not': {'$elemMatch': {'time': {'$gte': bars[0]['time'], '$lte': bars[-1]['time']}}}}
+            },
+            cls._push_update(field, bars, sort=True)
         )
-        
-        if existing_stock:
-            # 更新现有复权因子数据
-            mongo_client.update_one(
-                cls.COLLECTION_NAME,
-                {
-                    'code': code,
-                    'adjustFactor.time': adjust_factor_data['time']
-                },
-                {'$set': {'adjustFactor.$': adjust_factor_data}}
-            )
-            logger.debug(f"更新股票复权因子: {code}, 日期: {adjust_factor_data['time']}")
-        else:
-            # 添加新的复权因子数据
-            mongo_client.update_one(
-                cls.COLLECTION_NAME,
-                {'code': code},
-                {'$push': {'adjustFactor': adjust_factor_data}}
-            )
-            logger.debug(f"添加股票复权因子: {code}, 日期: {adjust_factor_data['time']}")
+        return len(bars) if modified else 0
     
     @classmethod
-    def get_stock_by_code(cls, code):
+    def _push_update(cls, field, bars, sort=False):
+        """构造追加K线的更新语句，同时推进最新K线时间字段"""
+        push = {'$each': bars}
+        if sort:
+            push['$sort'] = {'time': 1}
+        update = {'$push': {field: push}}
+        watermark = cls.watermark_field(field)
+        if watermark:
+            update['$max'] = {watermark: max(bar['time'] for bar in bars)}
+        return update
+    
+    @classmethod
+    def get_stock_by_code(cls, code, projection=None):
         """根据股票代码获取股票信息"""
         mongo_client = MongoClient()
-        return mongo_client.find_one(cls.COLLECTION_NAME, {'code': code})
+        return mongo_client.find_one(cls.COLLECTION_NAME, {'code': code}, projection)
     
     @classmethod
     def get_all_stocks(cls, query=None, projection=None):
@@ -180,18 +431,56 @@ class StockModel:
         mongo_client = MongoClient()
         return mongo_client.find(cls.COLLECTION_NAME, query, projection)
     
+    @classmethod
+    def iter_stock_batches(cls, query=None, projection=None, batch_size=None):
+        """按股票代码分页流式获取股票，每次返回一批文档
+        
+        每页都是按代码续读的独立查询，调用方处理单批耗时较长时也不会遇到游标超时
+        """
+        mongo_client = MongoClient()
+        batch_size = batch_size or config.get_mongodb_config().get('cursor_batch_size', 500)
+        # 分页依赖code字段，包含型投影需要带上code
+        if projection and any(value == 1 or value is True for key, value in projection.items() if key != '_id'):
+            projection = {**projection, 'code': 1}
+        
+        last_code = None
+        while True:
+            page_query = query or {}
+            if last_code is not None:
+                page_query = {'$and': [page_query, {'code': {'$gt': last_code}}]}
+            batch = mongo_client.find(
+                cls.COLLECTION_NAME,
+                page_query,
+                projection,
+                sort=[('code', 1)],
+                limit=batch_size
+            )
+            if not batch:
+                return
+            yield batch
+            if len(batch) < batch_size:
+                return
+            last_code = batch[-1]['code']
+    
+    @classmethod
+    def iter_stocks(cls, query=None, projection=None, batch_size=None):
+        """流式逐个获取股票，内存中最多只保留一批文档"""
+        for batch in cls.iter_stock_batches(query, projection, batch_size):
+            yield from batch
+    
     @classmethod
     def get_latest_trading_date(cls):
         """获取最新交易日期"""
         mongo_client = MongoClient()
-        # 按日期降序排序，获取第一条记录的日期
+        # 按最新日线时间降序排序，走 dayLineEnd 索引只读取一个标量字段
         result = mongo_client.find(
             cls.COLLECTION_NAME,
-            projection={'dayLine.time': 1},
-            sort=[('dayLine.time', -1)],
+            query={'dayLineEnd': {'$exists': True}},
+            projection={'_id': 0, 'dayLineEnd': 1},
+            sort=[('dayLineEnd', -1)],
             limit=1
         )
         
-        if result and result[0].get('dayLine') and len(result[0]['dayLine']) > 0:
-            return result[0]['dayLine'][0]['time']
+        if result:
+            return result[0]['dayLineEnd']
         return None
\ No newline at end of file
@@ -3,18 +3,37 @@
 A股数据获取与存储工具主程序
 """
 import argparse
+import contextlib
+import json
+import multiprocessing
+import os
 import sys
 from datetime import datetime, timedelta
 
 from utils.logger import logger
-from data_processing import StockProcessor
+from utils.log_benchmark import LogBenchmark
+from utils.profiler import CommandProfiler
+from utils.memory import MemoryGuard
+from data_processing import (
+    StockProcessor, JobWorker, IntradayPoller, BackfillPlanner, ChangeFeed, MarketMatrix
+)
+from data_processing.bar_validator import BarValidator
 from data_fetch import BaostockClient
 from db_operations.stock_model import StockModel
+from db_operations.job_queue import JobQueue
+from db_operations.backfill_chunk_model import BackfillChunkModel
+from db_operations.data_quality_model import DataQualityModel
+from db_operations.index_benchmark import IndexBenchmark
+from db_operations.snapshot_model import SnapshotModel
 
 def setup_indexes():
     """设置数据库索引"""
     try:
         StockModel.setup_indexes()
+        JobQueue.setup_indexes()
+        BackfillChunkModel.setup_indexes()
+        DataQualityModel.setup_indexes()
+        SnapshotModel.setup_indexes()
         logger.info("数据库索引设置成功")
     except Exception as e:
         logger.error(f"设置数据库索引失败: {e}")
@@ -35,15 +54,15 @@ def update_daily_data(code=None, start_date=None, end_date=None):
         if code:
             # 更新单只股票
             count = StockProcessor.process_daily_data(code, start_date, end_date)
-            logger.info(f"股票 {code} 日线数据更新完成，共处理 {count} 条记录")
+            logger.info(f"股票 {code} 日线数据更新完成，共处理 {count} 条记录，峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB")
         else:
             # 更新所有股票
-            stocks = StockModel.get_all_stocks(projection={'code': 1})
+            stocks = StockModel.iter_stocks(projection={'code': 1})
             total_count = 0
             for stock in stocks:
                 count = StockProcessor.process_daily_data(stock['code'], start_date, end_date)
                 total_count += count
-            logger.info(f"所有股票日线数据更新完成，共处理 {total_count} 条记录")
+            logger.info(f"所有股票日线数据更新完成，共处理 {total_count} 条记录，峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB")
     except Exception as e:
         logger.error(f"更新日线数据失败: {e}")
         sys.exit(1)
@@ -54,15 +73,15 @@ def update_hourly_data(code=None, start_date=None, end_date=None):
         if code:
             # 更新单只股票
             count = StockProcessor.process_hourly_data(code, start_date, end_date)
-            logger.info(f"股票 {code} 小时线数据更新完成，共处理 {count} 条记录")
+            logger.info(f"股票 {code} 小时线数据更新完成，共处理 {count} 条记录，峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB")
         else:
             # 更新所有股票
-            stocks = StockModel.get_all_stocks(projection={'code': 1})
+            stocks = StockModel.iter_stocks(projection={'code': 1})
             total_count = 0
             for stock in stocks:
                 count = StockProcessor.process_hourly_data(stock['code'], start_date, end_date)
                 total_count += count
-            logger.info(f"所有股票小时线数据更新完成，共处理 {total_count} 条记录")
+            logger.info(f"所有股票小时线数据更新完成，共处理 {total_count} 条记录，峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB")
     except Exception as e:
         logger.error(f"更新小时线数据失败: {e}")
         sys.exit(1)
@@ -76,16 +95,210 @@ def update_adjust_factor(code=None, start_date=None, end_date=None):
             logger.info(f"股票 {code} 复权因子数据更新完成，共处理 {count} 条记录")
         else:
             # 更新所有股票
-            stocks = StockModel.get_all_stocks(projection={'code': 1})
+            stocks = StockModel.iter_stocks(projection={'code': 1})
             total_count = 0
             for stock in stocks:
                 count = StockProcessor.process_adjust_factor(stock['code'], start_date, end_date)
                 total_count += count
             logger.info(f"所有股票复权因子数据更新完成，共处理 {total_count} 条记录")
+        logger.info(
+            f"当前共有 {StockModel.count_adjust_cache_stale()} 只股票的复权K线需要重新获取，"
+            f"下次执行 update --adjust 1/2 时自动处理"
+        )
     except Exception as e:
         logger.error(f"更新复权因子数据失败: {e}")
         sys.exit(1)
 
+def update_multi_frequency(frequencies=None, adjustflag=None, code=None, start_date=None, end_date=None):
+    """一次遍历股票更新多个频率的K线数据"""
+    try:
+        total_count, failed = StockProcessor.process_update(frequencies, adjustflag, code, start_date, end_date)
+        logger.info(
+            f"多频率K线数据更新完成，共写入 {total_count} 条记录，失败 {failed} 只股票，"
+            f"峰值内存 {MemoryGuard.peak_rss_mb():.0f} MB"
+        )
+    except Exception as e:
+        logger.error(f"更新多频率K线数据失败: {e}")
+        sys.exit(1)
+
+def submit_job(command, start_date=None, end_date=None, job_id=None, batch_size=None):
+    """创建分布式更新任务"""
+    try:
+        stocks = StockModel.iter_stocks(projection={'code': 1})
+        params = {'start_date': start_date, 'end_date': end_date}
+        job_id = JobQueue.create_job(
+            command,
+            (stock['code'] for stock in stocks),
+            params=params,
+            job_id=job_id,
+            batch_size=batch_size
+        )
+        logger.info(f"任务已提交，任务ID: {job_id}")
+    except Exception as e:
+        logger.error(f"提交任务失败: {e}")
+        sys.exit(1)
+
+def run_worker(job_id, processes=1, lease_seconds=None):
+    """运行任务工作进程，processes大于1时在本机启动多个独立进程模拟多节点"""
+    try:
+        if processes <= 1:
+            total_count = JobWorker(job_id, lease_seconds=lease_seconds).run()
+            logger.info(f"任务 {job_id} 工作进程结束，共处理 {total_count} 条记录")
+            return
+
+        # 使用spawn启动子进程，避免复制父进程的数据库连接和BaoStock会话
+        context = multiprocessing.get_context('spawn')
+        workers = [
+            context.Process(target=JobWorker.run_in_process, args=(job_id, lease_seconds))
+            for _ in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        failed = [worker.pid for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"工作进程异常退出: {failed}")
+        logger.info(f"任务 {job_id} 的 {processes} 个工作进程全部结束")
+    except Exception as e:
+        logger.error(f"运行任务工作进程失败: {e}")
+        sys.exit(1)
+
+def show_job_status(job_id):
+    """查看分布式任务进度"""
+    try:
+        status = JobQueue.get_job_status(job_id)
+        logger.info(
+            f"任务 {job_id} 进度: 待处理 {status['pending']}，处理中 {status['running']}，"
+            f"已完成 {status['done']}，失败 {status['failed']}"
+        )
+    except Exception as e:
+        logger.error(f"查询任务进度失败: {e}")
+        sys.exit(1)
+
+def poll_intraday(interval=None, budget=None, once=False, ignore_trading_hours=False):
+    """盘中轮询更新关注股票的小时线数据"""
+    try:
+        IntradayPoller(interval, budget).run(once=once, ignore_trading_hours=ignore_trading_hours)
+    except KeyboardInterrupt:
+        logger.info("盘中轮询已停止")
+    except Exception as e:
+        logger.error(f"盘中轮询失败: {e}")
+        sys.exit(1)
+
+def backfill_history(frequency, code=None, end_date=None, workers=None):
+    """分片并行回补历史K线数据"""
+    try:
+        BackfillPlanner.plan(frequency, code, end_date)
+        status = BackfillPlanner.run(frequency, code, workers)
+        if status['failed']:
+            logger.warning(f"有 {status['failed']} 个分片多次重试后仍失败，重新执行回补命令可继续重试")
+    except Exception as e:
+        logger.error(f"回补历史数据失败: {e}")
+        sys.exit(1)
+
+def consume_events(position=None, position_file=None, follow=False):
+    """按消费位置增量读取K线变更事件，以JSON行输出到标准输出"""
+    try:
+        # 位置文件优先，保证进程重启后从上次消费的位置继续
+        if position_file and os.path.exists(position_file):
+            with open(position_file, 'r', encoding='utf-8') as f:
+                position = json.load(f)
+        elif position is not None:
+            position = json.loads(position)
+
+        for position, event in ChangeFeed.consume(position, follow):
+            print(json.dumps({'position': position, 'event': event}, ensure_ascii=False, default=str), flush=True)
+            if position_file:
+                # 先写临时文件再原子替换，写入中途崩溃不会留下损坏的位置文件
+                temp_file = f"{position_file}.tmp"
+                with open(temp_file, 'w', encoding='utf-8') as f:
+                    json.dump(position, f, default=str)
+                os.replace(temp_file, position_file)
+    except KeyboardInterrupt:
+        logger.info("事件消费已停止")
+    except Exception as e:
+        logger.error(f"消费K线变更事件失败: {e}")
+        sys.exit(1)
+
+def rebuild_snapshots():
+    """根据已有K线重建截面快照"""
+    try:
+        count = SnapshotModel.rebuild()
+        logger.info(f"截面快照重建完成，共处理 {count} 只股票")
+    except Exception as e:
+        logger.error(f"重建截面快照失败: {e}")
+        sys.exit(1)
+
+def screen_market(metric, top=20, ascending=False, date=None):
+    """按截面快照指标筛选全市场股票"""
+    try:
+        for rank, snapshot in enumerate(SnapshotModel.screen(metric, top, ascending, date=date), start=1):
+            time_field = 'dayTime' if metric.startswith('day') else 'hourTime'
+            logger.info(f"{rank:>3}. {snapshot['code']} {metric}={snapshot[metric]:.4f} 时间 {snapshot.get(time_field)}")
+    except Exception as e:
+        logger.error(f"全市场筛选失败: {e}")
+        sys.exit(1)
+
+def build_market_matrix(start_date, end_date, window=None, min_periods=None, block_size=None,
+                        source='auto', refresh=False):
+    """构建全市场收益率、滚动波动率和相关系数矩阵"""
+    try:
+        matrix = MarketMatrix(start_date, end_date, window, min_periods, block_size)
+        output_dir = matrix.build(source, refresh)
+        logger.info(f"全市场矩阵结果目录: {output_dir}")
+    except Exception as e:
+        logger.error(f"构建全市场矩阵失败: {e}")
+        sys.exit(1)
+
+def show_quality_report(code=None, frequency='d', check='suspended', top=20):
+    """输出数据校验发现的问题数量，指定股票时输出该股票的明细，否则按校验项列出问题最多的股票"""
+    try:
+        if code:
+            report = DataQualityModel.get_report(code, frequency)
+            if not report:
+                logger.info(f"股票 {code} 频率 {frequency} 没有校验问题记录")
+                return
+            logger.info(f"股票 {code} 频率 {frequency} 问题统计: {report.get('counts', {})}")
+            for name, times in report.get('issues', {}).items():
+                recent = ', '.join(str(time) for time in sorted(times)[-5:])
+                logger.info(f"  {name}: 共 {len(times)} 条，最近 {recent}")
+        else:
+            for report in DataQualityModel.top_reports(frequency, check, top):
+                logger.info(f"{report['code']}: {report.get('counts', {})}")
+    except Exception as e:
+        logger.error(f"获取数据质量报告失败: {e}")
+        sys.exit(1)
+
+def show_index_report():
+    """输出股票集合各索引的使用情况"""
+    try:
+        for item in StockModel.index_usage_report():
+            logger.info(
+                f"索引 {item['name']} {item['key']}: 访问 {item['ops']} 次（自 {item['since']} 起），"
+                f"大小 {item['size'] / 1024 / 1024:.1f} MB"
+            )
+    except Exception as e:
+        logger.error(f"获取索引使用情况失败: {e}")
+        sys.exit(1)
+
+def benchmark_indexes(stocks, bars, operations):
+    """对比旧版和当前索引布局的读写开销"""
+    try:
+        IndexBenchmark.run(stocks, bars, operations)
+    except Exception as e:
+        logger.error(f"索引基准测试失败: {e}")
+        sys.exit(1)
+
+def benchmark_logging(iterations):
+    """测量日志调用开销"""
+    try:
+        LogBenchmark.run(iterations)
+    except Exception as e:
+        logger.error(f"日志基准测试失败: {e}")
+        sys.exit(1)
+
 def cleanup():
     """清理资源"""
     try:
@@ -93,10 +306,19 @@ def cleanup():
         logger.info("资源清理完成")
     except Exception as e:
         logger.error(f"资源清理失败: {e}")
+    finally:
+        # 等待队列中的日志全部写出
+        logger.complete()
 
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(description='A股数据获取与存储工具')
+    parser.add_argument('--profile', action='store_true', help='对命令进行耗时采样和内存峰值分析')
+    parser.add_argument('--profile-dir', help='性能分析结果输出目录')
+    parser.add_argument('--profile-clock', choices=list(CommandProfiler.CLOCKS),
+                        help='采样时钟：cpu 只统计CPU耗时，wall 按墙钟统计（含网络和数据库等待）')
+    parser.add_argument('--profile-memory', action='store_true', default=None,
+                        help='同时用 tracemalloc 跟踪内存分配，会拖慢频繁分配内存的代码，建议与耗时分析分开运行')
     
     # 添加子命令
     subparsers = parser.add_subparsers(dest='command', help='可用命令')
@@ -122,27 +344,156 @@ def main():
     adjust_parser.add_argument('--start-date', help='开始日期，格式：YYYY-MM-DD')
     adjust_parser.add_argument('--end-date', help='结束日期，格式：YYYY-MM-DD')
     
+    # 多频率K线数据更新命令
+    update_parser = subparsers.add_parser('update', help='一次遍历股票更新多个频率的K线数据')
+    update_parser.add_argument('--frequencies', help='K线频率，逗号分隔，可选 d,w,m,5,15,30,60，默认取配置文件')
+    update_parser.add_argument('--adjust', choices=sorted(StockModel.ADJUST_SUFFIXES),
+                               help='复权方式：3不复权，2前复权，1后复权，默认取配置文件')
+    update_parser.add_argument('--code', help='股票代码，如不指定则更新所有股票')
+    update_parser.add_argument('--start-date', help='尚无数据的频率从该日期开始获取，格式：YYYY-MM-DD')
+    update_parser.add_argument('--end-date', help='结束日期，格式：YYYY-MM-DD')
+    
+    # 分布式任务提交命令
+    submit_parser = subparsers.add_parser('submit-job', help='提交分布式更新任务')
+    submit_parser.add_argument('--command', dest='job_command', required=True,
+                               choices=sorted(JobWorker.HANDLERS), help='任务执行的更新命令')
+    submit_parser.add_argument('--job-id', help='任务ID，如不指定则自动生成')
+    submit_parser.add_argument('--batch-size', type=int, help='每个批次包含的股票数量')
+    submit_parser.add_argument('--start-date', help='开始日期，格式：YYYY-MM-DD')
+    submit_parser.add_argument('--end-date', help='结束日期，格式：YYYY-MM-DD')
+    
+    # 分布式任务工作进程命令
+    worker_parser = subparsers.add_parser('worker', help='运行分布式任务工作进程')
+    worker_parser.add_argument('--job-id', required=True, help='任务ID')
+    worker_parser.add_argument('--processes', type=int, default=1, help='本机启动的工作进程数量')
+    worker_parser.add_argument('--lease-seconds', type=int, help='批次租约时长（秒）')
+    
+    # 分布式任务进度命令
+    job_status_parser = subparsers.add_parser('job-status', help='查看分布式任务进度')
+    job_status_parser.add_argument('--job-id', required=True, help='任务ID')
+    
+    # 盘中轮询命令
+    poll_parser = subparsers.add_parser('poll', help='盘中轮询，优先刷新星标和关注股票的小时线')
+    poll_parser.add_argument('--interval', type=int, help='轮询间隔（秒）')
+    poll_parser.add_argument('--budget', type=int, help='每轮最多刷新的股票数量，星标和关注股票不受限制')
+    poll_parser.add_argument('--once', action='store_true', help='只执行一轮轮询')
+    poll_parser.add_argument('--ignore-trading-hours', action='store_true', help='非交易时段也执行轮询')
+    
+    # 历史数据回补命令
+    backfill_parser = subparsers.add_parser('backfill', help='分片并行回补历史K线数据')
+    backfill_parser.add_argument('--frequency', required=True, choices=sorted(BackfillPlanner.FREQUENCIES),
+                                 help='K线频率：d为日线，60为小时线')
+    backfill_parser.add_argument('--code', help='股票代码，如不指定则回补所有股票')
+    backfill_parser.add_argument('--end-date', help='结束日期，格式：YYYY-MM-DD')
+    backfill_parser.add_argument('--workers', type=int, help='并行获取的进程数量')
+    
+    # K线变更事件消费命令
+    events_parser = subparsers.add_parser('consume-events', help='增量读取新写入K线的变更事件')
+    events_parser.add_argument('--position',
+                               help='消费位置（JSON），文件通道为字节偏移，MongoDB通道为恢复令牌；'
+                                    '不指定时从第一条事件开始读取')
+    events_parser.add_argument('--position-file', help='保存消费位置的文件，每处理一个事件更新一次')
+    events_parser.add_argument('--follow', action='store_true', help='持续等待新事件')
+    
+    # 截面快照重建命令
+    rebuild_snapshots_parser = subparsers.add_parser('rebuild-snapshots', help='根据已有K线重建截面快照')
+    
+    # 全市场筛选命令
+    screen_parser = subparsers.add_parser('screen', help='按截面快照指标筛选全市场股票')
+    screen_parser.add_argument('--metric', default='dayReturn', choices=SnapshotModel.METRICS, help='筛选指标')
+    screen_parser.add_argument('--top', type=int, default=20, help='返回的股票数量')
+    screen_parser.add_argument('--ascending', action='store_true', help='按指标升序排列')
+    screen_parser.add_argument('--date', help='只比较最新K线在该交易日的股票，格式：YYYY-MM-DD，默认为最新交易日')
+    
+    # 全市场矩阵命令
+    matrix_parser = subparsers.add_parser('matrix', help='构建全市场收益率、滚动波动率和相关系数矩阵')
+    matrix_parser.add_argument('--start-date', required=True, help='开始日期，格式：YYYY-MM-DD')
+    matrix_parser.add_argument('--end-date', required=True, help='结束日期，格式：YYYY-MM-DD')
+    matrix_parser.add_argument('--window', type=int, help='滚动波动率窗口（交易日）')
+    matrix_parser.add_argument('--min-periods', type=int, help='计算波动率和相关系数所需的最少有效样本数')
+    matrix_parser.add_argument('--block-size', type=int, help='分块计算时每块的股票数量')
+    matrix_parser.add_argument('--source', default='auto', choices=['auto', 'db', 'cache'],
+                               help='价格数据来源：auto优先本地缓存，db从数据库读取，cache只读本地缓存')
+    matrix_parser.add_argument('--refresh', action='store_true', help='忽略已缓存的结果重新计算')
+    
+    # 数据质量报告命令
+    quality_parser = subparsers.add_parser('quality-report', help='查看数据校验发现的问题数量')
+    quality_parser.add_argument('--code', help='股票代码，如不指定则列出问题最多的股票')
+    quality_parser.add_argument('--frequency', default='d', choices=sorted(StockModel.LINE_FIELDS),
+                                help='K线频率')
+    quality_parser.add_argument('--check', default='suspended',
+                                choices=list(BarValidator.CHECKS) + ['volumeSpike'],
+                                help='未指定股票时按该校验项排序')
+    quality_parser.add_argument('--top', type=int, default=20, help='列出的股票数量')
+    
+    # 索引使用情况命令
+    index_report_parser = subparsers.add_parser('index-report', help='查看股票集合各索引的访问次数和大小')
+    
+    # 索引布局基准测试命令
+    bench_indexes_parser = subparsers.add_parser('bench-indexes', help='在临时集合上对比旧版和当前索引布局的读写开销')
+    bench_indexes_parser.add_argument('--stocks', type=int, default=200, help='合成股票数量')
+    bench_indexes_parser.add_argument('--bars', type=int, default=2000, help='每只股票的K线数量')
+    bench_indexes_parser.add_argument('--operations', type=int, default=500, help='每个测试项的操作次数')
+    
+    # 日志开销基准测试命令
+    bench_logging_parser = subparsers.add_parser('bench-logging', help='测量日志调用开销')
+    bench_logging_parser.add_argument('--iterations', type=int, default=100000, help='每个场景的日志调用次数')
+    
     # 初始化命令
     init_parser = subparsers.add_parser('init', help='初始化数据库')
     
     # 解析命令行参数
     args = parser.parse_args()
     
+    profiler = CommandProfiler(
+        args.command, args.profile_dir, clock=args.profile_clock, trace_memory=args.profile_memory
+    ) if args.profile else contextlib.nullcontext()
     try:
-        # 根据命令执行相应操作
-        if args.command == 'update-stock-list':
-            update_stock_list()
-        elif args.command == 'update-daily':
-            update_daily_data(args.code, args.start_date, args.end_date)
-        elif args.command == 'update-hourly':
-            update_hourly_data(args.code, args.start_date, args.end_date)
-        elif args.command == 'update-adjust-factor':
-            update_adjust_factor(args.code, args.start_date, args.end_date)
-        elif args.command == 'init':
-            setup_indexes()
-            logger.info("数据库初始化完成")
-        else:
-            parser.print_help()
+        with profiler:
+            # 根据命令执行相应操作
+            if args.command == 'update-stock-list':
+                update_stock_list()
+            elif args.command == 'update-daily':
+                update_daily_data(args.code, args.start_date, args.end_date)
+            elif args.command == 'update-hourly':
+                update_hourly_data(args.code, args.start_date, args.end_date)
+            elif args.command == 'update-adjust-factor':
+                update_adjust_factor(args.code, args.start_date, args.end_date)
+            elif args.command == 'update':
+                frequencies = args.frequencies.split(',') if args.frequencies else None
+                update_multi_frequency(frequencies, args.adjust, args.code, args.start_date, args.end_date)
+            elif args.command == 'submit-job':
+                submit_job(args.job_command, args.start_date, args.end_date, args.job_id, args.batch_size)
+            elif args.command == 'worker':
+                run_worker(args.job_id, args.processes, args.lease_seconds)
+            elif args.command == 'job-status':
+                show_job_status(args.job_id)
+            elif args.command == 'poll':
+                poll_intraday(args.interval, args.budget, args.once, args.ignore_trading_hours)
+            elif args.command == 'backfill':
+                backfill_history(args.frequency, args.code, args.end_date, args.workers)
+            elif args.command == 'consume-events':
+                consume_events(args.position, args.position_file, args.follow)
+            elif args.command == 'rebuild-snapshots':
+                rebuild_snapshots()
+            elif args.command == 'screen':
+                screen_market(args.metric, args.top, args.ascending, args.date)
+            elif args.command == 'matrix':
+                build_market_matrix(args.start_date, args.end_date, args.window, args.min_periods,
+                                    args.block_size, args.source, args.refresh)
+            elif args.command == 'quality-report':
+                show_quality_report(args.code, args.frequency, args.check, args.top)
+            elif args.command == 'index-report':
+                show_index_report()
+            elif args.command == 'bench-indexes':
+                benchmark_indexes(args.stocks, args.bars, args.operations)
+            elif args.command == 'bench-logging':
+                benchmark_logging(args.iterations)
+            elif args.command == 'init':
+                setup_indexes()
+                logger.info("数据库初始化完成")
+            else:
+                parser.print_help()
     finally:
         cleanup()
 
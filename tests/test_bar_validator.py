@@ -0,0 +1,84 @@
+"""
+K线校验测试：列式分块的异常剔除、跨分块重复和成交量异常放大，不需要MongoDB
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from data_processing.bar_validator import BarValidator
+from db_operations.data_quality_model import DataQualityModel
+
+START = datetime(2024, 1, 2)
+
+@pytest.fixture
+def recorded(monkeypatch):
+    """记录写入数据质量集合的内容，代替数据库写入"""
+    calls = []
+    monkeypatch.setattr(DataQualityModel, 'record', lambda code, frequency, issues: calls.append(issues))
+    return calls
+
+def _chunk(count, **overrides):
+    """构造每天一条、价格和成交量正常的列式分块，overrides 按 {列: {行号: 值}} 修改个别行"""
+    chunk = {
+        'time': np.array([START + timedelta(days=i) for i in range(count)], dtype='datetime64[us]'),
+        'open': np.full(count, 10.0),
+        'high': np.full(count, 11.0),
+        'low': np.full(count, 9.0),
+        'close': np.full(count, 10.5),
+        'volume': np.full(count, 1000.0),
+        'amount': np.full(count, 10000.0),
+        'tradeStatus': np.full(count, '1'),
+    }
+    for column, rows in overrides.items():
+        for row, value in rows.items():
+            chunk[column][row] = value
+    return chunk
+
+def test_rejects_invalid_rows_and_sorts(recorded):
+    chunk = _chunk(6, tradeStatus={1: '0'}, low={2: 0.0}, close={2: 0.0}, high={3: 8.0}, volume={4: -1.0})
+    chunk['time'][5], chunk['time'][0] = chunk['time'][0], chunk['time'][5]
+
+    clean, counts = BarValidator.validate_chunk('sh.600000', chunk, 'd')
+
+    assert counts['suspended'] == counts['nonPositivePrice'] == counts['ohlcInvalid'] == counts['badVolume'] == 1
+    assert list(clean['time']) == sorted(chunk['time'][[5, 0]])
+    assert 'tradeStatus' not in clean
+    assert set(recorded[0]) == {'suspended', 'nonPositivePrice', 'ohlcInvalid', 'badVolume'}
+
+def test_adjusted_keeps_non_positive_prices(recorded):
+    chunk = _chunk(3, open={0: -1.0}, low={0: -2.0}, close={0: -1.0})
+
+    clean, counts = BarValidator.validate_chunk('sh.600000', chunk, 'd', adjusted=True)
+
+    assert counts['nonPositivePrice'] == 0
+    assert len(clean['time']) == 3
+
+def test_duplicates_within_and_across_chunks(recorded):
+    chunk = _chunk(4)
+    chunk['time'][2] = chunk['time'][1]
+    chunk['close'][2] = 10.8
+
+    clean, counts = BarValidator.validate_chunk('sh.600000', chunk, 'd', after=START)
+
+    # 分块内重复保留最后一条，不晚于上一分块最后时间的行也按重复剔除
+    assert counts['duplicate'] == 2
+    assert list(clean['close']) == [10.8, 10.5]
+
+def test_volume_spike_uses_chunk_median_for_large_chunks(recorded):
+    chunk = _chunk(30, volume={10: 1000.0 * 100})
+
+    clean, counts = BarValidator.validate_chunk('sh.600000', chunk, 'd', baseline_volume=1.0)
+
+    # 只标记不剔除；分块足够大时不使用传入的基准
+    assert counts['volumeSpike'] == 1
+    assert len(clean['time']) == 30
+
+def test_volume_spike_uses_baseline_for_small_batches(recorded):
+    chunk = _chunk(2, volume={1: 1000.0 * 100})
+
+    _, without_baseline = BarValidator.validate_chunk('sh.600000', chunk, 'd')
+    _, with_baseline = BarValidator.validate_chunk('sh.600000', chunk, 'd', baseline_volume=1000.0)
+
+    assert without_baseline['volumeSpike'] == 0
+    assert with_baseline['volumeSpike'] == 1
@@ -0,0 +1,113 @@
+"""
+任务队列多进程测试：在本机启动多个工作进程处理同一个任务，需要可连接的MongoDB
+"""
+import multiprocessing
+import os
+import time
+import uuid
+from collections import Counter
+
+import pymongo
+import pytest
+
+from config import Config, config
+from db_operations.mongo_client import MongoClient
+from db_operations.job_queue import JobQueue
+from data_processing.job_worker import JobWorker
+
+COMMAND = 'test-record'
+PROCESSED_COLLECTION = 'test_processed_codes'
+LEASE_SECONDS = 2
+
+def _configure(db_name):
+    """让当前进程使用测试数据库，并缩短空闲等待时间"""
+    Config._load_config()
+    Config._config['mongodb']['db_name'] = db_name
+    Config._config['job_queue'].update({'idle_poll_seconds': 0.2, 'max_attempts': 3})
+    MongoClient._instance = None
+    MongoClient._client = None
+    MongoClient._db = None
+
+def _record_code(code, start_date=None, end_date=None):
+    """替代真实更新的处理函数，记录处理过的股票代码"""
+    MongoClient().insert_one(PROCESSED_COLLECTION, {'code': code, 'pid': os.getpid()})
+    time.sleep(0.02)
+    return 1
+
+def _hang(code, start_date=None, end_date=None):
+    """模拟卡住的处理函数，持有批次直到进程被杀掉"""
+    time.sleep(3600)
+
+def _worker_main(job_id, db_name, hang=False):
+    """子进程入口"""
+    _configure(db_name)
+    JobWorker.HANDLERS = {COMMAND: _hang if hang else _record_code}
+    JobWorker.run_in_process(job_id, LEASE_SECONDS)
+
+def _start_workers(context, job_id, db_name, count, hang=False):
+    processes = [context.Process(target=_worker_main, args=(job_id, db_name, hang)) for _ in range(count)]
+    for process in processes:
+        process.start()
+    return processes
+
+def _join(processes, timeout=60):
+    for process in processes:
+        process.join(timeout)
+        assert process.exitcode == 0, f"工作进程异常退出: {process.exitcode}"
+
+def _processed_counts():
+    return Counter(doc['code'] for doc in MongoClient().find(PROCESSED_COLLECTION, {}))
+
+@pytest.fixture
+def db_name():
+    mongo_config = config.get_mongodb_config()
+    try:
+        client = pymongo.MongoClient(
+            mongo_config.get('host', 'localhost'), mongo_config.get('port', 27017), serverSelectionTimeoutMS=500
+        )
+        client.admin.command('ping')
+    except pymongo.errors.PyMongoError:
+        # CI中设置 REQUIRE_MONGODB 后连接不上直接失败，避免测试被静默跳过
+        if os.environ.get('REQUIRE_MONGODB'):
+            raise
+        pytest.skip("没有可连接的MongoDB")
+
+    name = f"awatcher_test_{uuid.uuid4().hex[:8]}"
+    _configure(name)
+    yield name
+    client.drop_database(name)
+    client.close()
+    _configure(mongo_config.get('db_name', 'alib'))
+    Config._load_config()
+
+@pytest.fixture
+def context():
+    return multiprocessing.get_context('spawn')
+
+def test_each_code_processed_exactly_once(db_name, context):
+    codes = [f'sh.{i:06d}' for i in range(40)]
+    job_id = JobQueue.create_job(COMMAND, codes, batch_size=5)
+
+    _join(_start_workers(context, job_id, db_name, 4))
+
+    assert _processed_counts() == Counter(codes)
+    assert JobQueue.get_job_status(job_id) == {'pending': 0, 'running': 0, 'done': 8, 'failed': 0}
+
+def test_batch_of_killed_worker_is_reclaimed(db_name, context):
+    codes = [f'sz.{i:06d}' for i in range(10)]
+    job_id = JobQueue.create_job(COMMAND, codes, batch_size=5)
+
+    stuck = _start_workers(context, job_id, db_name, 1, hang=True)[0]
+    deadline = time.time() + 30
+    while JobQueue.get_job_status(job_id)['running'] == 0:
+        assert time.time() < deadline, "卡住的工作进程没有领取批次"
+        time.sleep(0.1)
+    stuck.kill()
+    stuck.join()
+
+    _join(_start_workers(context, job_id, db_name, 2))
+
+    assert _processed_counts() == Counter(codes)
+    assert JobQueue.get_job_status(job_id)['done'] == 2
+    reclaimed = MongoClient().find(JobQueue.COLLECTION_NAME, {'jobId': job_id, 'attempts': {'$gt': 1}})
+    assert [batch['batchNo'] for batch in reclaimed] == [0]
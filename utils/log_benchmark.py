@@ -0,0 +1,53 @@
+"""
+日志开销基准测试模块，对比不同日志写法和处理器模式的耗时
+"""
+import tempfile
+import time
+from pathlib import Path
+
+from .logger import logger, setup_logger
+
+class LogBenchmark:
+    """日志开销基准测试类"""
+
+    # 模拟一条小时线原始数据
+    SAMPLE_ROW = ['2024-01-02', '20240102103000000', '10.01', '10.20', '9.98', '10.12', '1234500', '12500000.00']
+
+    @classmethod
+    def _measure(cls, iterations, emit):
+        """执行指定次数的日志调用，返回每次调用的平均耗时（微秒）"""
+        started = time.perf_counter()
+        for _ in range(iterations):
+            emit()
+        return (time.perf_counter() - started) / iterations * 1e6
+
+    @classmethod
+    def run(cls, iterations=100000):
+        """运行基准测试，返回各场景每次调用的平均耗时（微秒）"""
+        row = cls.SAMPLE_ROW
+        results = {}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            log_file = str(Path(temp_dir) / 'bench.log')
+            try:
+                # DEBUG关闭时，f-string仍会格式化，而参数化消息直接返回
+                logger.remove()
+                logger.add(log_file, level='INFO')
+                results['DEBUG关闭 f-string(微秒/次)'] = cls._measure(iterations, lambda: logger.debug(f"小时线原始数据: {row}"))
+                results['DEBUG关闭 参数化(微秒/次)'] = cls._measure(iterations, lambda: logger.debug("小时线原始数据: {}", row))
+                results['同步文件处理器(微秒/次)'] = cls._measure(iterations, lambda: logger.info("小时线原始数据: {}", row))
+
+                # 队列处理器：调用方只负责入队，写入由后台线程完成
+                logger.remove()
+                logger.add(log_file, level='INFO', enqueue=True)
+                results['队列文件处理器(微秒/次)'] = cls._measure(iterations, lambda: logger.info("小时线原始数据: {}", row))
+                drain_started = time.perf_counter()
+                logger.complete()
+                results['队列排空总耗时(毫秒)'] = (time.perf_counter() - drain_started) * 1e3
+            finally:
+                logger.remove()
+                setup_logger()
+
+        for name, value in results.items():
+            logger.info(f"日志基准 {name}: {value:.3f}")
+        return results
@@ -3,6 +3,7 @@
 """
 import os
 import sys
+from collections import Counter, defaultdict
 from pathlib import Path
 from loguru import logger
 
@@ -16,26 +17,59 @@ def setup_logger():
     log_level = log_config.get('level', 'INFO')
     log_file = log_config.get('file_path', 'logs/awatcher.log')
     rotation = log_config.get('rotation', '10 MB')
-    
+    # 开启后由后台线程写入，调用方不再等待终端和磁盘IO，但每条消息需要序列化入队，
+    # 本地磁盘上单次调用反而更慢（见 bench-logging），适合日志写到慢速存储时使用
+    enqueue = log_config.get('enqueue', False)
+
     # 确保日志目录存在
     log_dir = os.path.dirname(log_file)
     Path(log_dir).mkdir(parents=True, exist_ok=True)
-    
+
     # 清除默认处理器
     logger.remove()
-    
+
     # 添加控制台处理器
-    logger.add(sys.stderr, level=log_level)
-    
+    logger.add(sys.stderr, level=log_level, enqueue=enqueue)
+
     # 添加文件处理器
     logger.add(
         log_file,
         rotation=rotation,
         level=log_level,
+        enqueue=enqueue,
         format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message} | {file}:{line}"
     )
-    
+
     return logger
 
+class EventSampler:
+    """日志采样器，同一类高频事件每隔固定次数才输出一次"""
+
+    def __init__(self, every=None):
+        self.every = every or config.get_logging_config().get('sample_every', 1000)
+        self._counts = Counter()
+
+    def should_log(self, key):
+        """记录一次事件，返回本次是否需要输出日志"""
+        self._counts[key] += 1
+        return self._counts[key] % self.every == 1 or self.every == 1
+
+class EventAggregator:
+    """日志聚合器，将逐条K线事件累计为每只股票一条汇总日志"""
+
+    def __init__(self):
+        self._counts = defaultdict(Counter)
+
+    def record(self, code, event, count=1):
+        """累计某只股票的事件次数"""
+        self._counts[code][event] += count
+
+    def flush(self, code, title, level='DEBUG'):
+        """输出并清空某只股票的事件汇总"""
+        counts = self._counts.pop(code, None)
+        if counts:
+            logger.log(level, "{} {}: {}", title, code, dict(counts))
+        return counts or Counter()
+
 # 导出配置好的日志记录器
-logger = setup_logger()
\ No newline at end of file
+logger = setup_logger()
@@ -0,0 +1,62 @@
+"""
+内存控制模块，读取进程常驻内存并按内存上限调整数据分块大小
+"""
+import gc
+import os
+import sys
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块
+    resource = None
+
+from .logger import logger
+from config import config
+
+class MemoryGuard:
+    """内存上限控制类，常驻内存超过上限时减小每块K线的行数，回落后逐步恢复"""
+
+    def __init__(self, limit_mb=None, chunk_size=None, min_chunk_size=None):
+        ingestion_config = config.get_ingestion_config()
+        self.limit = (limit_mb or ingestion_config.get('memory_limit_mb', 1024)) * 1024 * 1024
+        self.max_chunk_size = chunk_size or ingestion_config.get('chunk_size', 5000)
+        self.min_chunk_size = min(min_chunk_size or ingestion_config.get('min_chunk_size', 500), self.max_chunk_size)
+        self.chunk_size = self.max_chunk_size
+
+    @staticmethod
+    def current_rss():
+        """获取当前常驻内存（字节），优先读取 /proc/self/statm"""
+        try:
+            with open('/proc/self/statm') as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return MemoryGuard.peak_rss()
+
+    @staticmethod
+    def peak_rss(children=False):
+        """获取进程启动以来的常驻内存峰值（字节），children为True时取已结束子进程中的最大值"""
+        if resource is None:
+            return 0
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN if children else resource.RUSAGE_SELF).ru_maxrss
+        # Linux下单位为KB，macOS下为字节
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    @classmethod
+    def peak_rss_mb(cls, children=False):
+        """获取常驻内存峰值（MB）"""
+        return cls.peak_rss(children) / 1024 / 1024
+
+    def check(self):
+        """检查当前常驻内存并调整分块大小，返回当前常驻内存（字节）"""
+        rss = self.current_rss()
+        if rss > self.limit:
+            gc.collect()
+            if self.chunk_size > self.min_chunk_size:
+                self.chunk_size = max(self.chunk_size // 2, self.min_chunk_size)
+                logger.warning(
+                    f"常驻内存 {rss / 1024 / 1024:.0f} MB 超过上限 {self.limit / 1024 / 1024:.0f} MB，"
+                    f"分块大小调整为 {self.chunk_size} 条"
+                )
+        elif rss < self.limit / 2 and self.chunk_size < self.max_chunk_size:
+            self.chunk_size = min(self.chunk_size * 2, self.max_chunk_size)
+        return rss
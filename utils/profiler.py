@@ -0,0 +1,191 @@
+"""
+命令性能分析模块，提供CPU/墙钟采样和内存峰值跟踪
+"""
+import os
+import signal
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+from .logger import logger
+from .memory import MemoryGuard
+from config import config
+
+class CommandProfiler:
+    """命令性能分析类，以上下文管理器方式包裹命令执行，结束后输出采样栈和热点汇总"""
+
+    PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    PROJECT_MODULES = ('main', 'data_fetch', 'data_processing', 'db_operations', 'utils')
+    # 主要依赖按文件路径归类
+    LIBRARY_MARKERS = (
+        ('baostock', f'{os.sep}baostock{os.sep}'),
+        ('bson', f'{os.sep}bson{os.sep}'),
+        ('pymongo', f'{os.sep}pymongo{os.sep}'),
+        ('strptime', f'{os.sep}_strptime.py'),
+        ('loguru', f'{os.sep}loguru{os.sep}'),
+    )
+
+    # 采样时钟：cpu 只在进程占用CPU时计时，wall 按墙钟计时，可看到网络和数据库等待
+    CLOCKS = {
+        'cpu': ('ITIMER_PROF', 'SIGPROF'),
+        'wall': ('ITIMER_REAL', 'SIGALRM'),
+    }
+
+    def __init__(self, command, output_dir=None, interval_ms=None, top_n=None, clock=None, trace_memory=None):
+        profiling_config = config.get_profiling_config()
+        self.command = command or 'help'
+        # tracemalloc 会使频繁分配内存的代码明显变慢，默认只采样耗时，需要内存分配明细时单独开启
+        self.trace_memory = trace_memory if trace_memory is not None else profiling_config.get('trace_memory', False)
+        self.clock = clock or profiling_config.get('clock', 'cpu')
+        if self.clock not in self.CLOCKS:
+            raise ValueError(f"不支持的采样时钟: {self.clock}，可选 {', '.join(self.CLOCKS)}")
+        self.output_dir = output_dir or profiling_config.get('output_dir', 'profiles')
+        self.interval = (interval_ms or profiling_config.get('sample_interval_ms', 5)) / 1000
+        self.top_n = top_n or profiling_config.get('top_n', 20)
+        self.samples = Counter()
+        self._previous_handler = None
+        self._started = None
+        self._cpu_started = None
+
+    @classmethod
+    def categorize(cls, filename):
+        """根据文件路径判断所属的项目模块或依赖库"""
+        if filename.startswith(cls.PROJECT_ROOT + os.sep) and 'site-packages' not in filename:
+            top = os.path.relpath(filename, cls.PROJECT_ROOT).split(os.sep)[0]
+            if top == 'main.py':
+                return 'main'
+            if top in cls.PROJECT_MODULES:
+                return top
+        for name, marker in cls.LIBRARY_MARKERS:
+            if marker in filename:
+                return name
+        return 'other'
+
+    def _sample(self, signum, frame):
+        """定时信号处理函数，记录被中断时的调用栈（从外到内）"""
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append((code.co_filename, code.co_name, code.co_firstlineno))
+            frame = frame.f_back
+        self.samples[tuple(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._cpu_started = time.process_time()
+        if self.trace_memory:
+            tracemalloc.start()
+        if hasattr(signal, 'setitimer'):
+            timer, signum = self._timer()
+            self._previous_handler = signal.signal(signum, self._sample)
+            signal.setitimer(timer, self.interval, self.interval)
+        else:
+            logger.warning("当前平台不支持定时采样，仅记录耗时和内存峰值")
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if hasattr(signal, 'setitimer'):
+            timer, signum = self._timer()
+            signal.setitimer(timer, 0, 0)
+            signal.signal(signum, self._previous_handler or signal.SIG_DFL)
+        elapsed = time.perf_counter() - self._started
+        cpu_time = time.process_time() - self._cpu_started
+        peak, snapshot = None, None
+        if self.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            # 排除采样器自身保存调用栈产生的分配
+            snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, __file__)])
+            tracemalloc.stop()
+
+        try:
+            self._write_report(elapsed, cpu_time, peak, snapshot)
+        except Exception as e:
+            logger.error(f"写入性能分析结果失败: {e}")
+        return False
+
+    def _timer(self):
+        """获取采样时钟对应的定时器和信号"""
+        timer, signum = self.CLOCKS[self.clock]
+        return getattr(signal, timer), getattr(signal, signum)
+
+    def _format_frame(self, frame):
+        """格式化栈帧，项目内文件显示相对路径"""
+        filename, function, line = frame
+        if filename.startswith(self.PROJECT_ROOT + os.sep):
+            filename = os.path.relpath(filename, self.PROJECT_ROOT)
+        return f"{function} ({filename}:{line})"
+
+    def summarize(self):
+        """汇总采样结果：按模块的自身耗时、函数自身耗时和项目函数累计耗时"""
+        category_self = Counter()
+        function_self = Counter()
+        project_inclusive = Counter()
+        # 项目函数下方调用的依赖，用于定位耗时具体落在哪个库
+        project_breakdown = {}
+
+        for stack, count in self.samples.items():
+            leaf = stack[-1]
+            leaf_category = self.categorize(leaf[0])
+            category_self[leaf_category] += count
+            function_self[leaf] += count
+
+            # 样本计入栈中每个项目函数的累计耗时，递归调用的函数只计一次
+            for frame in set(stack):
+                if self.categorize(frame[0]) in self.PROJECT_MODULES:
+                    project_inclusive[frame] += count
+                    project_breakdown.setdefault(frame, Counter())[leaf_category] += count
+
+        return category_self, function_self, project_inclusive, project_breakdown
+
+    def _write_report(self, elapsed, cpu_time, peak, snapshot):
+        """写出采样栈（折叠格式，可直接生成火焰图）和热点汇总"""
+        run_dir = Path(self.output_dir) / f"{self.command}-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
+        run_dir.mkdir(parents=True, exist_ok=True)
+
+        with open(run_dir / 'stacks.folded', 'w', encoding='utf-8') as f:
+            for stack, count in self.samples.most_common():
+                f.write(';'.join(self._format_frame(frame) for frame in stack) + f" {count}\n")
+
+        total = sum(self.samples.values()) or 1
+        category_self, function_self, project_inclusive, project_breakdown = self.summarize()
+        lines = [
+            f"命令: {self.command}",
+            f"耗时: {elapsed:.2f} 秒，采样 {sum(self.samples.values())} 次"
+            f"（{self.clock} 时钟，间隔 {self.interval * 1000:.0f} 毫秒）",
+            # 墙钟远大于CPU时间说明主要在等待网络、数据库或子进程，此时应使用 wall 时钟采样
+            f"CPU时间: {cpu_time:.2f} 秒，等待时间: {max(elapsed - cpu_time, 0):.2f} 秒",
+            f"常驻内存峰值: {MemoryGuard.peak_rss_mb():.0f} MB",
+        ]
+        if self.trace_memory:
+            lines += [
+                f"Python内存峰值: {peak / 1024 / 1024:.1f} MB",
+                "注意: 已开启 tracemalloc 内存跟踪，耗时包含其开销，频繁分配内存的函数（如K线转换、BSON编码）"
+                "占比偏高，网络和数据库等待占比偏低；分析耗时请关闭内存跟踪单独运行",
+            ]
+        lines += ["", "按模块统计（自身耗时占比）:"]
+        for category, count in category_self.most_common():
+            lines.append(f"  {category:<16} {count / total:6.1%}")
+
+        lines += ["", f"项目函数累计耗时 Top {self.top_n}（含其调用的依赖库）:"]
+        for frame, count in project_inclusive.most_common(self.top_n):
+            breakdown = ', '.join(
+                f"{category} {value / count:.0%}" for category, value in project_breakdown[frame].most_common(3)
+            )
+            lines.append(f"  {count / total:6.1%}  {self._format_frame(frame)}  [{breakdown}]")
+
+        lines += ["", f"函数自身耗时 Top {self.top_n}:"]
+        for frame, count in function_self.most_common(self.top_n):
+            lines.append(f"  {count / total:6.1%}  {self._format_frame(frame)}")
+
+        if snapshot is not None:
+            lines += ["", f"内存分配 Top {self.top_n}:"]
+            for stat in snapshot.statistics('lineno')[:self.top_n]:
+                lines.append(f"  {stat.size / 1024:10.1f} KB  {stat.traceback}")
+
+        summary = '\n'.join(lines) + '\n'
+        with open(run_dir / 'summary.txt', 'w', encoding='utf-8') as f:
+            f.write(summary)
+        logger.info("性能热点汇总:\n{}", summary)
+        logger.info(f"性能分析结果已写入 {run_dir}")